@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Benchmark the refund orchestration layer with FakeDriver
+Generates synthetic refund logs, runs them through the same queue/bookkeeping/summary
+code as production, and reports throughput per phase
+
+Usage:
+    python3 benchmark_engine.py --rows 1000000 --files 20
+    python3 benchmark_engine.py --rows 2000 --nodes 4 --latency 0.01 --lease-store /tmp/bench.sqlite --crash-after 50
+    python3 benchmark_engine.py --rows 100000 --shuffle   # same totals as the serial run
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from collections import Counter
+from decimal import Decimal
+from pathlib import Path
+
+from fake_driver import FakeDriver
+from lease_store import INTERRUPTED, LeaseStore, apply_store_results, run_leased
+from refund_engine import (RunStats, build_work_queue, quiet, run_queue,
+                           save_csv_progress)
+
+FIELDNAMES = ['Order Link', 'Order Number', 'Card Name', 'Set Name', 'Cond.', 'Quant.',
+              'Solved?', 'Original Amount', 'Cost to Fix']
+CONDITIONS = ['NM', 'LP', 'MP', 'HP', 'DM', 'NMF', 'LPF', 'NMH']
+
+
+def synthetic_sources(rows, files, seed=0, invalid_rate=0.01):
+    """
+    Build in-memory CSV sources shaped like real refund logs
+    Orders have 1-4 cards and their rows are scattered across files, so cross-file
+    grouping and first-card tracking are exercised
+    """
+    rng = random.Random(seed)
+    sources = [{'path': Path(f'synthetic_{i + 1:03d}.csv'), 'fieldnames': FIELDNAMES, 'refunds': []}
+               for i in range(files)]
+
+    order_index = 0
+    generated = 0
+    while generated < rows:
+        order_index += 1
+        order_number = f"{251000 + order_index // 10000}-{order_index % 10000:04X}"
+        order_url = f"https://store.tcgplayer.com/admin/Direct/Order/{order_number}"
+
+        for card in range(min(rng.randint(1, 4), rows - generated)):
+            quantity = '' if rng.random() < invalid_rate else str(rng.randint(1, 4))
+            rng.choice(sources)['refunds'].append({
+                'Order Link': order_url,
+                'Order Number': order_number,
+                'Card Name': f"Synthetic Card {order_index}-{card}",
+                'Set Name': f"Set {order_index % 97}",
+                'Cond.': rng.choice(CONDITIONS),
+                'Quant.': quantity,
+                'Solved?': '',
+                'Original Amount': '',
+                'Cost to Fix': '',
+            })
+            generated += 1
+
+    return sources
+
+
+class NodeCrashed(Exception):
+    """Raised by CrashingFakeDriver to simulate a node dying mid-refund"""
+
+
+class CrashingFakeDriver(FakeDriver):
+    """FakeDriver that dies while submitting its Nth refund (after the submit went through)"""
+
+    def __init__(self, crash_after, **kwargs):
+        super().__init__(**kwargs)
+        self.crash_after = crash_after
+
+    async def submit_refund(self):
+        submitted = await super().submit_refund()
+        if len(self.submitted) >= self.crash_after:
+            raise NodeCrashed()
+        return submitted
+
+
+def cost_totals(sources):
+    """Sum the Cost to Fix column and count solved rows across all sources"""
+    total = Decimal('0.00')
+    solved = 0
+    for source in sources:
+        for refund in source['refunds']:
+            if refund['Solved?'] == 'TRUE':
+                solved += 1
+            if refund['Cost to Fix']:
+                total += Decimal(refund['Cost to Fix'].lstrip('$'))
+    return total, solved
+
+
+def check_drivers(drivers):
+    """Verify no card was refunded twice and no order got more than one store credit"""
+    submitted = [entry for driver in drivers for entry in driver.submitted]
+    store_credits = [order for driver in drivers for order in driver.store_credits]
+    refunded = Counter((order_url, card_name) for order_url, card_name, _ in submitted)
+    credited = Counter(store_credits)
+    double_refunds = sum(1 for count in refunded.values() if count > 1)
+    double_credits = sum(1 for count in credited.values() if count > 1)
+
+    print(f"  Refunds submitted: {len(submitted)}")
+    print(f"  International credits: {len(store_credits)}")
+    if double_refunds or double_credits:
+        print(f"  ✗ {double_refunds} cards refunded twice, {double_credits} orders credited twice")
+    else:
+        print("  ✓ No double refunds or double credits")
+
+
+async def run_nodes(sources, queue, stats, seed, nodes, lease_store, crash_after=None, latency=0):
+    """
+    Simulate several nodes sharing one lease store (each with its own connection and driver)
+    With crash_after, node-1 dies mid-refund and the others must recover its order
+    """
+    lease_seconds = 1  # Short leases so a crashed node's order is recovered quickly
+    LeaseStore(lease_store).load(queue, sources)
+
+    drivers = []
+    node_tasks = []
+    for index in range(nodes):
+        node_id = f"node-{index + 1}"
+        if crash_after and index == 0:
+            driver = CrashingFakeDriver(crash_after, seed=seed, latency=latency)
+        else:
+            driver = FakeDriver(seed=seed, latency=latency)
+        drivers.append(driver)
+        store = LeaseStore(lease_store, node_id, lease_seconds=lease_seconds)
+        node_tasks.append(run_node(driver, store, stats))
+
+    processed = await asyncio.gather(*node_tasks)
+    print(f"\n  Rows per node: {', '.join(str(count) for count in processed)}")
+    return drivers
+
+
+async def run_node(driver, store, stats):
+    try:
+        return await run_leased(driver, store, stats, delay=0, idle_wait=0.2, log=quiet)
+    except NodeCrashed:
+        print(f"  ✗ {store.node_id} crashed after {len(driver.submitted)} refunds (lease left to expire)")
+        return len(driver.submitted)
+
+
+async def run_benchmark(rows, files, seed, output_dir=None, nodes=1, lease_store=None, crash_after=None,
+                        latency=0, shuffle=False):
+    phases = []
+
+    start = time.perf_counter()
+    sources = synthetic_sources(rows, files, seed)
+    phases.append(('Generate rows', time.perf_counter() - start))
+
+    start = time.perf_counter()
+    queue = build_work_queue(sources)
+    phases.append(('Build work queue', time.perf_counter() - start))
+
+    if shuffle:
+        # The plan is already compiled, so execution order must not change the outcome
+        random.Random(seed).shuffle(queue)
+
+    stats = RunStats()
+    start = time.perf_counter()
+    if lease_store:
+        drivers = await run_nodes(sources, queue, stats, seed, nodes, lease_store, crash_after, latency)
+    else:
+        drivers = [FakeDriver(seed=seed, latency=latency)]
+        await run_queue(drivers[0], queue, stats, save_progress=False, delay=0, log=quiet)
+    phases.append(('Process queue', time.perf_counter() - start))
+
+    if lease_store:
+        # Nodes only journal into the store; pull results back into the rows
+        apply_store_results(LeaseStore(lease_store), sources)
+
+    if output_dir:
+        output_dir.mkdir(parents=True, exist_ok=True)
+        start = time.perf_counter()
+        for source in sources:
+            await save_csv_progress(output_dir / source['path'].name, source['refunds'], source['fieldnames'])
+        phases.append(('Write CSVs', time.perf_counter() - start))
+
+    stats.print_summary(len(queue))
+
+    print(f"\n{'='*80}")
+    print(f"BENCHMARK: {len(queue)} rows across {files} files"
+          + (f", {nodes} nodes sharing {lease_store}" if lease_store else '')
+          + (' (shuffled)' if shuffle else ''))
+    for label, seconds in phases:
+        rate = len(queue) / seconds if seconds > 0 else float('inf')
+        print(f"  {label}: {seconds:.2f}s ({rate:,.0f} rows/s)")
+    print()
+    total, solved = cost_totals(sources)
+    print(f"  Solved rows: {solved}, Cost to Fix total: ${total:.2f}")
+    check_drivers(drivers)
+    if lease_store:
+        needs_review = sum(1 for _, result in LeaseStore(lease_store).results().values()
+                           if result['error_reason'] == INTERRUPTED)
+        print(f"  Rows flagged for review after a node crash: {needs_review}")
+    print('='*80)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the refund engine with an in-memory driver')
+    parser.add_argument('--rows', type=int, default=100000, help='Number of synthetic rows')
+    parser.add_argument('--files', type=int, default=10, help='Number of synthetic CSV files')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for rows and driver outcomes')
+    parser.add_argument('--output-dir', type=Path, help='Also write the result CSVs here and time it')
+    parser.add_argument('--nodes', type=int, default=1, help='Simulated nodes sharing --lease-store')
+    parser.add_argument('--lease-store', type=Path, help='SQLite lease file (must not exist yet)')
+    parser.add_argument('--crash-after', type=int, help='Make node-1 die after this many refunds')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='Simulated seconds per page load/submit (shows scaling with --nodes)')
+    parser.add_argument('--shuffle', action='store_true',
+                        help='Run the compiled plan in random order (totals should match the serial run)')
+    args = parser.parse_args()
+
+    if args.lease_store and args.lease_store.exists():
+        parser.error(f'{args.lease_store} already exists - use a fresh file per benchmark')
+
+    asyncio.run(run_benchmark(args.rows, args.files, args.seed, args.output_dir,
+                              args.nodes, args.lease_store, args.crash_after, args.latency, args.shuffle))
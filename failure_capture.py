@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Failure-only debugging capture
+Keeps a rolling Playwright trace chunk for the current refund and only writes it
+to disk when the row fails (successful chunks are discarded). A cheaper DOM mode
+saves just the page HTML + screenshot at the moment of failure. Disk use is capped
+and tracing's effect on refund time is measured against an untraced baseline.
+"""
+
+import json
+import re
+import time
+from pathlib import Path
+
+from network_profiler import percentile
+
+TRACE = 'trace'
+DOM = 'dom'
+
+# Refund kinds timed separately (international refunds also add dashboard credit, so they run longer)
+KINDS = {False: 'Domestic', True: 'International'}
+
+# Names this class gives its files: 20251020-142501_0003_<order>_<reason>
+CAPTURE_NAME = re.compile(r'^\d{8}-\d{6}_\d{4,}_')
+
+
+class FailureCapture:
+    """
+    Usage:
+        capture = FailureCapture(context, page, 'failure_captures')
+        await capture.start()
+        await capture.begin_row()
+        ...
+        await capture.end_row(refund, result)
+        await capture.stop()
+        capture.print_report()
+    """
+
+    def __init__(self, context, page, output_dir, mode=TRACE, max_captures=50, max_bytes=500 * 1024 * 1024,
+                 overhead_budget_ms=150, baseline_rows=10):
+        """
+        Args:
+            context: Playwright browser context (owns tracing)
+            page: Page to snapshot in DOM mode
+            output_dir: Where failure captures are written
+            mode: 'trace' (rolling trace chunk) or 'dom' (HTML + screenshot on failure only)
+            max_captures: Oldest captures are deleted beyond this many
+            max_bytes: Oldest captures are deleted beyond this total size
+            overhead_budget_ms: Extra time per successful refund allowed with tracing on (vs the
+                untraced baseline of the same kind) before trace mode falls back to DOM mode
+            baseline_rows: Successful refunds of one kind (domestic/international) run without
+                tracing first to measure its baseline (failures among them get a DOM snapshot);
+                also the minimum traced sample per kind before the budget is checked
+        """
+        self.context = context
+        self.page = page
+        self.output_dir = Path(output_dir)
+        self.mode = mode
+        self.max_captures = max_captures
+        self.max_bytes = max_bytes
+        self.overhead_budget_ms = overhead_budget_ms
+        self.baseline_rows = baseline_rows
+
+        self.saved = []  # Paths written this run
+        self.baseline_ms = {kind: [] for kind in KINDS}  # Successful refund wall times before tracing
+        self.traced_ms = {kind: [] for kind in KINDS}  # Successful refund wall times with tracing on
+        self._row_started = 0.0
+        self._tracing = False
+        self._chunk_open = False
+        self._captures = 0  # Keeps names unique when failures land in the same second
+
+    async def start(self):
+        """Prepare the output folder (tracing starts once the baseline is measured)"""
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        print(f"✓ Failure capture enabled ({self.mode} mode) → {self.output_dir}\n")
+
+    async def stop(self):
+        if self._tracing:
+            await self.context.tracing.stop()
+            self._tracing = False
+
+    async def begin_row(self):
+        """Start a fresh trace chunk for the next refund"""
+        if self.mode == TRACE and max(len(times) for times in self.baseline_ms.values()) >= self.baseline_rows:
+            if not self._tracing:
+                # Tracing is started once for the whole run; chunks are rolled per row
+                await self.context.tracing.start(screenshots=True, snapshots=True)
+                self._tracing = True
+            await self.context.tracing.start_chunk()
+            self._chunk_open = True
+        self._row_started = time.perf_counter()
+
+    async def end_row(self, refund, result, touched_page=True):
+        """
+        Save the chunk/snapshot if the row failed; otherwise discard it
+        Rows that never touched the page (rejected by the pre-scan) are never captured
+        """
+        wall_ms = (time.perf_counter() - self._row_started) * 1000
+        failed = not result['success'] and not result['skipped']
+
+        if failed and touched_page:
+            await self._save(refund, result)
+            return
+
+        traced = self._chunk_open
+        if self._chunk_open:
+            await self.context.tracing.stop_chunk()  # No path: chunk is discarded
+            self._chunk_open = False
+
+        if failed or result['skipped']:
+            return
+        kind = bool(result['is_international'])
+        if traced:
+            self.traced_ms[kind].append(wall_ms)
+            await self._check_budget(kind)
+        elif self.mode == TRACE:
+            self.baseline_ms[kind].append(wall_ms)
+
+    def overhead_ms(self, kind, rows=None):
+        """
+        Average extra time of the last traced refunds of one kind over that kind's untraced
+        baseline (all traced refunds if rows is None)
+
+        Returns:
+            float, or None until the kind has baseline_rows samples both untraced and traced
+        """
+        baseline = self.baseline_ms[kind]
+        traced = self.traced_ms[kind][-rows:] if rows else self.traced_ms[kind]
+        if len(baseline) < self.baseline_rows or len(traced) < self.baseline_rows:
+            return None
+        return sum(traced) / len(traced) - sum(baseline) / len(baseline)
+
+    async def _check_budget(self, kind):
+        """Fall back to DOM mode if tracing slows successful refunds of this kind by more than the budget"""
+        overhead = self.overhead_ms(kind, rows=self.baseline_rows)
+        if overhead is not None and overhead > self.overhead_budget_ms:
+            print(f"⚠️  Tracing adds {overhead:.0f}ms per {KINDS[kind].lower()} refund "
+                  f"(budget {self.overhead_budget_ms}ms) - switching to DOM snapshots on failure")
+            await self.stop()
+            self.mode = DOM
+
+    async def _save(self, refund, result):
+        order = refund.get('Order Link', '').strip().rstrip('/').split('/')[-1]
+        slug = re.sub(r'[^A-Za-z0-9-]+', '_', f"{order}_{result['error_reason'] or 'failed'}").strip('_')
+        self._captures += 1
+        base = self.output_dir / f"{time.strftime('%Y%m%d-%H%M%S')}_{self._captures:04d}_{slug}"
+        paths = [base.with_suffix('.json')]
+
+        try:
+            if self._chunk_open:
+                paths.append(base.with_suffix('.zip'))
+                await self.context.tracing.stop_chunk(path=paths[-1])
+                self._chunk_open = False
+            else:
+                paths.append(base.with_suffix('.html'))
+                paths[-1].write_text(await self.page.content())
+                paths.append(base.with_suffix('.png'))
+                await self.page.screenshot(path=paths[-1])
+        except Exception as e:
+            self._chunk_open = False
+            print(f"  ⚠ Could not capture failure state: {e}")
+
+        paths[0].write_text(json.dumps({'row': refund, 'result': result}, indent=2, default=str))
+        self.saved.extend(path for path in paths if path.exists())
+        print(f"  📎 Failure captured: {base.name}")
+        self._enforce_limits()
+
+    def _enforce_limits(self):
+        """Delete the oldest captures (all files sharing a name) beyond the count/size caps"""
+        groups = {}
+        for path in self.output_dir.iterdir():
+            # Only files this class wrote (possibly in an earlier run) - never the operator's own
+            if path.suffix in ('.json', '.zip', '.html', '.png') and CAPTURE_NAME.match(path.name):
+                groups.setdefault(path.stem, []).append(path)
+
+        ordered = sorted(groups.items(), key=lambda x: min(path.stat().st_mtime for path in x[1]))
+        total = sum(path.stat().st_size for paths in groups.values() for path in paths)
+
+        while ordered and (len(ordered) > self.max_captures or total > self.max_bytes):
+            _, paths = ordered.pop(0)
+            for path in paths:
+                total -= path.stat().st_size
+                path.unlink()
+
+    def print_report(self):
+        print(f"\n{'='*80}")
+        print("FAILURE CAPTURE:")
+        print(f"  Mode: {self.mode}")
+        print(f"  Failures captured: {len({path.stem for path in self.saved})} → {self.output_dir}")
+        for kind, label in KINDS.items():
+            baseline, traced = self.baseline_ms[kind], self.traced_ms[kind]
+            if not traced:
+                continue
+            overhead = self.overhead_ms(kind)
+            if overhead is None:
+                print(f"  {label} tracing overhead: not measured (needs {self.baseline_rows} untraced and "
+                      f"traced refunds, had {len(baseline)} and {len(traced)})")
+                continue
+            print(f"  {label} tracing overhead: {overhead:+.0f}ms per successful refund "
+                  f"(budget {self.overhead_budget_ms}ms)")
+            print(f"    - Untraced: avg {sum(baseline) / len(baseline):.0f}ms over {len(baseline)} refunds")
+            print(f"    - Traced: avg {sum(traced) / len(traced):.0f}ms, "
+                  f"p95 {percentile(traced, 95):.0f}ms over {len(traced)} refunds")
+        print('='*80)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+In-memory refund driver for load-testing the engine
+No browser - every page step returns immediately (or after an optional simulated
+latency) with an outcome derived from a seeded hash of the order/card, so runs are repeatable
+"""
+
+import asyncio
+import zlib
+from decimal import Decimal
+
+from refund_engine import RefundDriver
+
+# Per-row probability of each failure, roughly matching production logs
+DEFAULT_FAILURE_RATES = {
+    'Page Timeout': 0.005,
+    'Card Not Found': 0.01,
+    'Already Refunded': 0.02,
+    'Form Load Error': 0.002,
+    'Quantity Fill Error': 0.002,
+    'Submit Error': 0.001,
+    'Store Credit Error': 0.001,
+}
+
+
+class FakeDriver(RefundDriver):
+    """
+    Simulates the admin site in memory
+
+    Tracks every submitted refund and store credit so callers can check that no
+    card was refunded twice and each order got at most one credit
+    """
+
+    def __init__(self, seed=0, international_rate=0.1, failure_rates=None, latency=0):
+        """
+        Args:
+            seed: Changes which rows fail / are international while keeping runs repeatable
+            international_rate: Fraction of orders that ship outside the US
+            failure_rates: dict of error reason -> probability (defaults to DEFAULT_FAILURE_RATES)
+            latency: Simulated seconds per page load / submit (lets concurrent nodes interleave)
+        """
+        self.seed = seed
+        self.latency = latency
+        self.international_rate = international_rate
+        self.failure_rates = DEFAULT_FAILURE_RATES if failure_rates is None else failure_rates
+
+        self.order_url = None
+        self.card_name = None
+        self.refund_data = None
+        self.submitted = []  # (order_url, card_name, quantity) per submitted refund
+        self.store_credits = []  # order numbers that received international credit
+        self._refunded = set()  # (order_url, card_name) already refunded on the "site"
+
+    def _roll(self, *parts):
+        """Deterministic float in [0, 1) for the given key parts"""
+        key = '|'.join(str(part) for part in (self.seed,) + parts)
+        return zlib.crc32(key.encode()) / 0x100000000
+
+    def _fails(self, reason):
+        rate = self.failure_rates.get(reason, 0)
+        return rate > 0 and self._roll(self.order_url, self.card_name, reason) < rate
+
+    async def open_order(self, order_url):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.order_url = order_url
+        self.card_name = None
+        return "Page Timeout" if self._fails("Page Timeout") else None
+
+    async def is_international(self):
+        # International is a property of the order, not the row
+        return self._roll(self.order_url, 'international') < self.international_rate
+
+    async def locate_partial_refund(self, card_name, set_name, condition):
+        self.card_name = card_name
+        if self._fails("Card Not Found"):
+            return False, None
+        if (self.order_url, card_name) in self._refunded or self._fails("Already Refunded"):
+            return True, None
+        return True, f"{self.order_url}/partialrefund"
+
+    async def open_refund_form(self, partial_refund_href):
+        return "Form Load Error" if self._fails("Form Load Error") else None
+
+    async def fill_refund_form(self, refund_data):
+        self.refund_data = refund_data
+        if self._fails("Quantity Fill Error"):
+            return False, None, "Quantity Fill Error"
+
+        # Cost column already includes quantity (qty x unit price)
+        cents = 25 + int(self._roll(self.order_url, self.card_name, 'price') * 2000)
+        return True, Decimal(cents) / 100 * refund_data['quantity'], None
+
+    async def submit_refund(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self._fails("Submit Error"):
+            return False
+        self._refunded.add((self.order_url, self.card_name))
+        self.submitted.append((self.order_url, self.card_name, self.refund_data['quantity']))
+        return True
+
+    async def add_store_credit(self, order_url, order_number):
+        if self._fails("Store Credit Error"):
+            return False
+        self.store_credits.append(order_number)
+        return True
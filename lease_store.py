@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+"""
+Lease-based work distribution across several machines
+A SQLite file on shared storage holds one batch per order. Nodes claim batches
+with expiring leases, heartbeat while working, journal every row, and pick up
+batches whose lease expired because a node died. A row that a dead node had
+started is never re-run (it may already be submitted) - it is flagged for review.
+
+Note: the store uses SQLite's rollback journal, not WAL - WAL keeps its index in
+shared memory and only works when every process is on the same host. Locking on
+network filesystems (NFS/SMB) is still only as good as the share's lock support;
+run the store on storage with working POSIX/Windows locks.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import time
+from pathlib import Path
+
+from refund_engine import (RESULT_COLUMNS, apply_result, from_json, parse_refund_row, plan_entry, refund_result,
+                           run_item, save_csv_progress, to_json)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS batches (
+    batch_id TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',  -- pending | leased | done
+    owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS rows (
+    batch_id TEXT NOT NULL,
+    row_index INTEGER NOT NULL,
+    source TEXT NOT NULL,       -- CSV path relative to the CSVs' common folder (source_names)
+    source_row INTEGER NOT NULL,  -- row position within that CSV
+    refund TEXT NOT NULL,       -- CSV row as JSON
+    card_name TEXT NOT NULL,    -- '' for rows the engine skips
+    row_hash TEXT NOT NULL,     -- row_identity() of the CSV row, checked before results are applied
+    plan TEXT,                  -- compiled plan entry as JSON (NULL for skipped rows)
+    state TEXT NOT NULL DEFAULT 'pending',  -- pending | started | done
+    node TEXT,
+    result TEXT,
+    PRIMARY KEY (batch_id, row_index)
+);
+CREATE INDEX IF NOT EXISTS batches_claim ON batches (status, seq);
+CREATE UNIQUE INDEX IF NOT EXISTS rows_source ON rows (source, source_row);
+"""
+
+INTERRUPTED = "Interrupted - Needs Review"
+
+
+class LeaseStoreError(Exception):
+    """The store can't be used with these CSVs (raised before any row is touched)"""
+
+
+def default_node_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def source_names(sources):
+    """
+    Name each CSV by its path relative to the folder all of them share, so two logs
+    with the same file name in different folders (e.g. "logs/*/refunds.csv") stay apart
+
+    Returns:
+        dict: id(source) -> name like "monday/refunds.csv"
+    """
+    paths = {id(source): Path(source['path']).resolve() for source in sources}
+    if not paths:
+        return {}
+    root = os.path.commonpath([str(path.parent) for path in paths.values()])
+    return {key: path.relative_to(root).as_posix() for key, path in paths.items()}
+
+
+def row_identity(refund):
+    """
+    Hash of a CSV row's input columns (result columns are left out, so a row
+    still matches after its result has been written back)
+    """
+    inputs = {key: value for key, value in refund.items() if key not in RESULT_COLUMNS}
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+class LeaseStore:
+    """
+    Shared work queue in a SQLite file
+
+    Every write runs in its own short IMMEDIATE transaction so nodes never hold the
+    database lock while a refund is in progress
+    """
+
+    def __init__(self, path, node_id=None, lease_seconds=300):
+        """
+        Args:
+            path: SQLite file shared by all nodes (created if missing)
+            node_id: This node's name in leases and the row journal
+            lease_seconds: How long a claim lasts without a heartbeat
+        """
+        self.path = Path(path)
+        self.node_id = node_id or default_node_id()
+        self.lease_seconds = lease_seconds
+
+        self.db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        # Rollback journal: nodes on different machines share the file (WAL needs one host)
+        self.db.execute('PRAGMA journal_mode=DELETE')
+        self.db.executescript(SCHEMA)
+
+        columns = {row['name'] for row in self.db.execute('PRAGMA table_info(rows)')}
+        if 'row_hash' not in columns:
+            raise LeaseStoreError(f"{self.path} was created by an older version - use a new lease file")
+
+    def close(self):
+        self.db.close()
+
+    def _transaction(self):
+        return _Transaction(self.db)
+
+    def load(self, queue, sources):
+        """
+        Add the queue's rows with their compiled plan entries, so every node can call this
+        with the same CSVs. Rows already in the store are left alone (every node runs the plan
+        of whichever node loaded them first). Rows new to an existing order are appended to
+        its batch, never as the order's credit owner, and a finished batch is reopened.
+
+        Args:
+            queue: Work queue built from sources, with its plan compiled
+            sources: Every CSV source passed to the run (also those without rows), so files
+                get the same names here as in apply_store_results
+
+        Raises:
+            LeaseStoreError: a CSV row differs from the row stored at the same file/position
+                (the store was loaded from other CSV contents), or a row the store already
+                has turns up under another file name (CSVs passed with a different layout,
+                which would run it twice); nothing is loaded
+
+        Returns:
+            tuple: (new orders, rows added to orders already in the store)
+        """
+        names = source_names(sources)
+
+        groups = {}
+        for item in queue:
+            batch_id = item['order_key'] or f"{names[id(item['source'])]}#{item['source_row']}"
+            groups.setdefault(batch_id, []).append(item)
+
+        added_orders = 0
+        added_rows = 0
+        mismatched = []
+        moved = []
+        with self._transaction() as db:
+            stored = {(row['source'], row['source_row']): row['row_hash']
+                      for row in db.execute('SELECT source, source_row, row_hash FROM rows')}
+            stored_hashes = set(stored.values())
+            seq = db.execute('SELECT COALESCE(MAX(seq), 0) FROM batches').fetchone()[0]
+
+            for batch_id, items in groups.items():
+                new_items = []
+                for item in items:
+                    key = (names[id(item['source'])], item['source_row'])
+                    identity = row_identity(item['refund'])
+                    if key in stored:
+                        if stored[key] != identity:
+                            mismatched.append(key)
+                    elif identity in stored_hashes:
+                        moved.append(key)
+                    else:
+                        new_items.append(item)
+                if mismatched or moved or not new_items:
+                    continue
+
+                batch = db.execute('SELECT status FROM batches WHERE batch_id = ?', (batch_id,)).fetchone()
+                if batch is None:
+                    seq += 1
+                    db.execute('INSERT INTO batches (batch_id, seq) VALUES (?, ?)', (batch_id, seq))
+                    first_index = 0
+                    has_owner = False
+                    added_orders += 1
+                else:
+                    first_index = db.execute('SELECT MAX(row_index) + 1 FROM rows WHERE batch_id = ?',
+                                             (batch_id,)).fetchone()[0]
+                    plans = [from_json(row['plan']) for row in
+                             db.execute('SELECT plan FROM rows WHERE batch_id = ?', (batch_id,))]
+                    has_owner = any(plan and plan['credit_owner'] for plan in plans)
+                    if batch['status'] == 'done':
+                        db.execute("UPDATE batches SET status = 'pending', lease_expires = NULL WHERE batch_id = ?",
+                                   (batch_id,))
+                    added_rows += len(new_items)
+
+                rows = []
+                for index, item in enumerate(new_items, first_index):
+                    plan = item['plan']
+                    if plan and plan['credit_owner'] and has_owner:
+                        # The order's credit was already planned for a row loaded earlier
+                        plan = plan_entry(False)
+                    row = parse_refund_row(item['refund'])
+                    rows.append((batch_id, index, names[id(item['source'])], item['source_row'],
+                                 json.dumps(item['refund']), row['card_name'] if row else '',
+                                 row_identity(item['refund']), to_json(plan)))
+                db.executemany(
+                    'INSERT INTO rows (batch_id, row_index, source, source_row, refund, card_name, row_hash, plan) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+            if mismatched:
+                source, source_row = mismatched[0]
+                raise LeaseStoreError(
+                    f"{len(mismatched)} CSV rows differ from the rows this lease store was loaded with "
+                    f"(first: {source} row {source_row + 2}) - use a new lease file for different CSVs")
+            if moved:
+                source, source_row = moved[0]
+                raise LeaseStoreError(
+                    f"{len(moved)} CSV rows are already in this lease store under another file name "
+                    f"(first: {source} row {source_row + 2}) - pass the CSVs with the same paths as the "
+                    "node that loaded them")
+        return added_orders, added_rows
+
+    def claim(self):
+        """
+        Lease the next pending batch, or one whose lease expired
+
+        Returns:
+            dict {'batch_id', 'attempts', 'rows': [...]} or None if nothing is claimable
+        """
+        now = time.time()
+        with self._transaction() as db:
+            batch = db.execute(
+                "SELECT batch_id, attempts FROM batches "
+                "WHERE status = 'pending' OR (status = 'leased' AND lease_expires < ?) "
+                "ORDER BY seq LIMIT 1", (now,)).fetchone()
+            if batch is None:
+                return None
+
+            db.execute("UPDATE batches SET status = 'leased', owner = ?, lease_expires = ?, attempts = attempts + 1 "
+                       "WHERE batch_id = ?", (self.node_id, now + self.lease_seconds, batch['batch_id']))
+            rows = db.execute('SELECT * FROM rows WHERE batch_id = ? ORDER BY row_index',
+                              (batch['batch_id'],)).fetchall()
+
+        return {
+            'batch_id': batch['batch_id'],
+            'attempts': batch['attempts'] + 1,
+            'rows': [dict(row, refund=json.loads(row['refund']), plan=from_json(row['plan'])) for row in rows],
+        }
+
+    def heartbeat(self, batch_id):
+        """Extend our lease. Returns False if another node has taken the batch"""
+        with self._transaction() as db:
+            cursor = db.execute(
+                "UPDATE batches SET lease_expires = ? WHERE batch_id = ? AND owner = ? AND status = 'leased'",
+                (time.time() + self.lease_seconds, batch_id, self.node_id))
+            return cursor.rowcount == 1
+
+    def start_row(self, batch_id, row_index):
+        """
+        Journal that we're about to process a row - only if we still hold the lease
+        and nobody has started it. Returns False if the row must not be processed
+        """
+        with self._transaction() as db:
+            owned = db.execute(
+                "SELECT 1 FROM batches WHERE batch_id = ? AND owner = ? AND status = 'leased' AND lease_expires >= ?",
+                (batch_id, self.node_id, time.time())).fetchone()
+            if not owned:
+                return False
+            cursor = db.execute(
+                "UPDATE rows SET state = 'started', node = ? WHERE batch_id = ? AND row_index = ? AND state = 'pending'",
+                (self.node_id, batch_id, row_index))
+            return cursor.rowcount == 1
+
+    def finish_row(self, batch_id, row_index, result):
+        with self._transaction() as db:
+            db.execute("UPDATE rows SET state = 'done', result = ? WHERE batch_id = ? AND row_index = ?",
+                       (to_json(result), batch_id, row_index))
+
+    def complete(self, batch_id):
+        """Mark our batch done - or pending again if another node appended rows to it meanwhile"""
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE batches SET lease_expires = NULL, status = CASE WHEN EXISTS ("
+                "SELECT 1 FROM rows WHERE rows.batch_id = batches.batch_id AND rows.state = 'pending'"
+                ") THEN 'pending' ELSE 'done' END WHERE batch_id = ? AND owner = ?",
+                (batch_id, self.node_id))
+
+    def outstanding(self):
+        """Batches not yet done (pending or leased by any node)"""
+        return self.db.execute("SELECT COUNT(*) FROM batches WHERE status != 'done'").fetchone()[0]
+
+    def results(self):
+        """
+        Every finished row's result
+
+        Returns:
+            dict: (source name from source_names(), source_row) -> (row_identity, result dict)
+        """
+        return {(row['source'], row['source_row']): (row['row_hash'], from_json(row['result']))
+                for row in self.db.execute(
+                    "SELECT source, source_row, row_hash, result FROM rows WHERE state = 'done'")}
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT/ROLLBACK around a block"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute('BEGIN IMMEDIATE')
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.execute('ROLLBACK' if exc_type else 'COMMIT')
+        return False
+
+
+async def _keep_lease(store, batch_id, lost):
+    """Heartbeat every third of the lease until cancelled; sets `lost` if the lease is gone"""
+    while True:
+        await asyncio.sleep(store.lease_seconds / 3)
+        if not store.heartbeat(batch_id):
+            lost.set()
+            return
+
+
+async def run_leased(driver, store, stats, delay=2, idle_wait=5, log=print):
+    """
+    Claim and process batches until every batch in the store is done
+
+    Args:
+        driver: RefundDriver performing the page work
+        store: LeaseStore shared with the other nodes
+        stats: RunStats for this node's rows
+        delay: Seconds to wait between refunds
+        idle_wait: Seconds to wait when other nodes still hold every remaining batch
+        log: print-like function for progress output
+
+    Returns:
+        int: rows processed by this node
+    """
+    processed = 0
+    while True:
+        batch = store.claim()
+        if batch is None:
+            if store.outstanding() == 0:
+                break
+            # Remaining batches are leased by other nodes; wait in case one dies
+            await asyncio.sleep(idle_wait)
+            continue
+
+        batch_id = batch['batch_id']
+        log(f"\n→ [{store.node_id}] Claimed order {batch_id} ({len(batch['rows'])} rows, attempt {batch['attempts']})")
+
+        lost = asyncio.Event()
+        keeper = asyncio.ensure_future(_keep_lease(store, batch_id, lost))
+        try:
+            for row in batch['rows']:
+                if row['state'] == 'done':
+                    continue
+                if row['state'] == 'started':
+                    # A dead node may have submitted this refund already - never run it twice
+                    log(f"⚠️  Row {row['source']}:{row['source_row'] + 2} was in progress on {row['node']} - needs review")
+                    store.finish_row(batch_id, row['row_index'], refund_result(False, error_reason=INTERRUPTED))
+                    continue
+                if lost.is_set() or not store.start_row(batch_id, row['row_index']):
+                    log(f"✗ Lost lease on order {batch_id} - leaving remaining rows to its new owner")
+                    break
+
+                item = {'refund': row['refund'], 'plan': row['plan']}
+                result = await run_item(driver, item, stats, log)
+                store.finish_row(batch_id, row['row_index'], result)
+                processed += 1
+
+                if not result['skipped'] and delay:
+                    driver.set_stage('idle')
+                    await asyncio.sleep(delay)
+            else:
+                store.complete(batch_id)
+        finally:
+            keeper.cancel()
+    return processed
+
+
+def apply_store_results(store, sources):
+    """
+    Apply every finished row's result from the store to the in-memory CSV rows
+    Rows are matched by source name (see source_names) and row position, and a result
+    is only applied if the CSV row is still the row the store ran (same row_identity)
+
+    Returns:
+        tuple: (rows updated, list of sources that changed)
+    """
+    results = store.results()
+    names = source_names(sources)
+    updated = 0
+    mismatched = 0
+    changed = []
+    for source in sources:
+        name = names[id(source)]
+        rows_before = updated
+        for index, refund in enumerate(source['refunds']):
+            if (name, index) not in results:
+                continue
+            row_hash, result = results[(name, index)]
+            if row_hash != row_identity(refund):
+                mismatched += 1
+                continue
+            apply_result(refund, result)
+            updated += 1
+        if updated > rows_before:
+            changed.append(source)
+
+    if mismatched:
+        print(f"⚠️  {mismatched} results not written back: the CSV row no longer matches the row the store ran")
+    return updated, changed
+
+
+async def export_results(store, sources):
+    """
+    Write every finished row's result from the store back into the local CSVs
+
+    Returns:
+        int: rows updated
+    """
+    updated, changed = apply_store_results(store, sources)
+    for source in changed:
+        await save_csv_progress(source['path'], source['refunds'], source['fieldnames'])
+    return updated
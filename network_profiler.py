@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Per-refund network waterfall profiler
+Records every request the browser context makes, attributes it to the refund
+stage that was active when it started, and reports latency/bytes per URL pattern
+"""
+
+import re
+import time
+from urllib.parse import urlsplit
+
+# Path segments that look like IDs (order numbers, GUIDs, hashes) are collapsed
+# so e.g. /admin/Direct/Order/251020-402C groups with every other order
+ID_SEGMENT = re.compile(r'\d{3,}|^[0-9a-fA-F-]{16,}$')
+
+
+def url_pattern(url):
+    """
+    Collapse a URL into a pattern for grouping
+    Drops the query string and replaces ID-like path segments with {id}
+    """
+    parts = urlsplit(url)
+    segments = ['{id}' if ID_SEGMENT.search(seg) else seg for seg in parts.path.split('/')]
+    return f"{parts.netloc}{'/'.join(segments)}"
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an unsorted list (0 if empty)"""
+    if not values:
+        return 0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class NetworkProfiler:
+    """
+    Collects request timings from a Playwright browser context
+
+    Usage:
+        profiler = NetworkProfiler()
+        profiler.attach(context)
+        profiler.set_stage('order_load')
+        ...
+        profiler.print_report()
+    """
+
+    def __init__(self):
+        self.stage = 'idle'
+        self._stage_started = time.time()
+        self._pending = {}  # request -> stage active when it was sent
+        # (stage, method, pattern) -> {'latencies': [ms], 'bytes': int, 'failed': int}
+        self.endpoints = {}
+        # stage -> {'visits': int, 'wall': seconds}
+        self.stages = {}
+
+    def attach(self, context):
+        """Subscribe to request events on every page of the context"""
+        context.on('request', self._on_request)
+        context.on('requestfinished', self._on_request_finished)
+        context.on('requestfailed', self._on_request_failed)
+
+    def _close_stage(self):
+        """Add the time since the active stage started to its wall time"""
+        now = time.time()
+        current = self.stages.setdefault(self.stage, {'visits': 0, 'wall': 0.0})
+        current['wall'] += now - self._stage_started
+        self._stage_started = now
+
+    def set_stage(self, stage):
+        """Switch the active stage; requests sent from now on are attributed to it"""
+        self._close_stage()
+        self.stage = stage
+        self.stages.setdefault(stage, {'visits': 0, 'wall': 0.0})['visits'] += 1
+
+    def _entry(self, stage, request):
+        key = (stage, request.method, url_pattern(request.url))
+        return self.endpoints.setdefault(key, {'latencies': [], 'bytes': 0, 'failed': 0})
+
+    def _on_request(self, request):
+        self._pending[request] = self.stage
+
+    async def _on_request_finished(self, request):
+        stage = self._pending.pop(request, self.stage)
+        entry = self._entry(stage, request)
+
+        # responseEnd is relative to startTime; -1 means the browser didn't report it
+        timing = request.timing
+        if timing.get('responseEnd', -1) >= 0:
+            entry['latencies'].append(timing['responseEnd'])
+
+        try:
+            sizes = await request.sizes()
+            entry['bytes'] += sum(max(0, value) for value in sizes.values())
+        except Exception:
+            pass  # Page may have navigated away before sizes were available
+
+    def _on_request_failed(self, request):
+        stage = self._pending.pop(request, self.stage)
+        self._entry(stage, request)['failed'] += 1
+
+    def _rows(self, endpoints):
+        """Aggregate (stage, method, pattern) entries into report rows"""
+        rows = []
+        for (stage, method, pattern), entry in endpoints:
+            latencies = entry['latencies']
+            rows.append({
+                'stage': stage,
+                'endpoint': f"{method} {pattern}",
+                'count': len(latencies) + entry['failed'],
+                'failed': entry['failed'],
+                'total_ms': sum(latencies),
+                'avg_ms': sum(latencies) / len(latencies) if latencies else 0,
+                'p95_ms': percentile(latencies, 95),
+                'max_ms': max(latencies) if latencies else 0,
+                'bytes': entry['bytes'],
+            })
+        return rows
+
+    def slowest_endpoints(self, limit=15):
+        """Endpoints ranked by total time across the whole run (all stages merged)"""
+        merged = {}
+        for (stage, method, pattern), entry in self.endpoints.items():
+            target = merged.setdefault(('all', method, pattern), {'latencies': [], 'bytes': 0, 'failed': 0})
+            target['latencies'].extend(entry['latencies'])
+            target['bytes'] += entry['bytes']
+            target['failed'] += entry['failed']
+
+        rows = self._rows(merged.items())
+        rows.sort(key=lambda row: row['total_ms'], reverse=True)
+        return rows[:limit]
+
+    def stage_report(self, limit=5):
+        """Top endpoints per stage, ranked by total time"""
+        by_stage = {}
+        for row in self._rows(self.endpoints.items()):
+            by_stage.setdefault(row['stage'], []).append(row)
+        for rows in by_stage.values():
+            rows.sort(key=lambda row: row['total_ms'], reverse=True)
+            del rows[limit:]
+        return by_stage
+
+    def print_report(self):
+        """Print stage wall times, per-stage endpoints and the run-wide slowest endpoints"""
+        # Count the active stage's wall time up to now
+        self._close_stage()
+
+        def fmt(row):
+            return (f"{row['count']:>5} req  avg {row['avg_ms']:>7.0f}ms  p95 {row['p95_ms']:>7.0f}ms  "
+                    f"max {row['max_ms']:>7.0f}ms  total {row['total_ms']/1000:>7.1f}s  "
+                    f"{row['bytes']/1024:>8.0f}KB  {row['endpoint']}"
+                    + (f"  ({row['failed']} failed)" if row['failed'] else ''))
+
+        print(f"\n{'='*80}")
+        print("NETWORK PROFILE:")
+
+        print("\n  Stage Wall Time:")
+        for stage, data in sorted(self.stages.items(), key=lambda x: x[1]['wall'], reverse=True):
+            if data['wall'] > 0:
+                print(f"    - {stage}: {data['wall']:.1f}s over {data['visits']} visits")
+
+        print("\n  Top Endpoints per Stage:")
+        for stage, rows in self.stage_report().items():
+            print(f"    [{stage}]")
+            for row in rows:
+                print(f"      {fmt(row)}")
+
+        print("\n  Slowest Endpoints (whole run, by total time):")
+        for rank, row in enumerate(self.slowest_endpoints(), 1):
+            print(f"    {rank:>2}. {fmt(row)}")
+
+        print('='*80)
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+Parse admin pages from raw HTML without a browser
+A tiny stdlib DOM (html.parser) plus the lookups the refund flow does in the page:
+shipping country, card widgets, Partial Refund links and refund form rows
+"""
+
+import re
+from decimal import Decimal, InvalidOperation
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+# Same XPath check_if_international() reads in the browser
+COUNTRY_XPATH = '/html/body/div[4]/div/div[6]/div[1]/div[1]/table/tbody/tr[8]/td[2]'
+
+# Normalize condition text (CSV uses abbreviations, page uses full text)
+# Keep in sync with conditionMap in REFUND_HELPERS_SCRIPT
+CONDITION_MAP = {
+    'NM': 'Near Mint',
+    'LP': 'Lightly Played',
+    'MP': 'Moderately Played',
+    'HP': 'Heavily Played',
+    'DM': 'Damaged',
+    # Foil variants
+    'NMF': 'Near Mint Foil',
+    'LPF': 'Lightly Played Foil',
+    'MPF': 'Moderately Played Foil',
+    'HPF': 'Heavily Played Foil',
+    'DMF': 'Damaged Foil',
+    # Pokemon holofoil variants
+    'NMH': 'Near Mint Holofoil',
+    'LPH': 'Lightly Played Holofoil',
+    'MPH': 'Moderately Played Holofoil',
+    'HPH': 'Heavily Played Holofoil',
+    'DMH': 'Damaged Holofoil',
+}
+
+# A widget whose card was already refunded says so (e.g. a "Refunded" badge)
+REFUNDED_MARKER = re.compile(r'\brefunded\b', re.IGNORECASE)
+
+# Shipping country cell holds an ISO code like "US" or "CA"
+COUNTRY_CODE = re.compile(r'^[A-Za-z]{2}$')
+
+# "$1.23", "1.23" or "$1,234.56"
+COST_PATTERN = re.compile(r'\$?\s*((?:[0-9]{1,3}(?:,[0-9]{3})+|[0-9]+)\.[0-9]{2})')
+
+# Per-product form fields, e.g. RefundProducts[0].Quantity -> ('RefundProducts[0]', 'Quantity')
+PRODUCT_FIELD = re.compile(r'^(.+\[\d+\])\.(\w+)$')
+
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta',
+             'param', 'source', 'track', 'wbr'}
+
+# Opening one of these closes a still-open sibling, as browsers do for unclosed cells/rows
+IMPLIED_END_TAGS = {
+    'td': {'td', 'th'},
+    'th': {'td', 'th'},
+    'tr': {'tr', 'td', 'th'},
+    'li': {'li'},
+    'option': {'option'},
+    'p': {'p'},
+}
+
+# Block elements close an open <p> (an unclosed paragraph must not swallow the next widget)
+BLOCK_TAGS = {'address', 'article', 'aside', 'blockquote', 'div', 'dl', 'fieldset', 'footer', 'form',
+              'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'nav', 'ol', 'pre', 'section', 'table', 'ul'}
+IMPLIED_END_TAGS.update({tag: IMPLIED_END_TAGS.get(tag, set()) | {'p'} for tag in BLOCK_TAGS})
+
+
+class Element:
+    """Minimal DOM element: tag, attributes, and mixed element/text children"""
+
+    __slots__ = ('tag', 'attrs', 'children', 'parent')
+
+    def __init__(self, tag, attrs, parent):
+        self.tag = tag
+        self.attrs = attrs
+        self.children = []
+        self.parent = parent
+
+    def get(self, name, default=None):
+        return self.attrs.get(name, default)
+
+    def classes(self):
+        return (self.attrs.get('class') or '').split()
+
+    def element_children(self):
+        return [child for child in self.children if isinstance(child, Element)]
+
+    def iter(self):
+        """All descendant elements, depth first in document order"""
+        for child in self.children:
+            if isinstance(child, Element):
+                yield child
+                yield from child.iter()
+
+    def find_all(self, tag=None, class_name=None):
+        return [element for element in self.iter()
+                if (tag is None or element.tag == tag)
+                and (class_name is None or class_name in element.classes())]
+
+    def text(self):
+        """Concatenated text content (like DOM textContent)"""
+        parts = []
+        for child in self.children:
+            parts.append(child.text() if isinstance(child, Element) else child)
+        return ''.join(parts)
+
+
+class _TreeBuilder(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.root = Element('#document', {}, None)
+        self.current = self.root
+
+    def handle_starttag(self, tag, attrs):
+        implied = IMPLIED_END_TAGS.get(tag)
+        while implied and self.current.tag in implied:
+            self.current = self.current.parent
+
+        element = Element(tag, dict(attrs), self.current)
+        self.current.children.append(element)
+        if tag not in VOID_TAGS:
+            self.current = element
+
+    def handle_startendtag(self, tag, attrs):
+        self.current.children.append(Element(tag, dict(attrs), self.current))
+
+    def handle_endtag(self, tag):
+        # Close the nearest open element with this tag; ignore stray end tags
+        node = self.current
+        while node is not self.root and node.tag != tag:
+            node = node.parent
+        if node is not self.root:
+            self.current = node.parent
+
+    def handle_data(self, data):
+        self.current.children.append(data)
+
+
+def parse_html(html):
+    """Parse an HTML document into an Element tree rooted at '#document'"""
+    builder = _TreeBuilder()
+    builder.feed(html)
+    builder.close()
+    return builder.root
+
+
+def resolve_xpath(root, xpath):
+    """
+    Resolve a simple absolute XPath like /html/body/div[4]/table/tbody/tr[8]/td[2]
+    tbody steps are optional because browsers insert tbody but raw HTML may omit it
+
+    Returns:
+        Element or None
+    """
+    node = root
+    for step in xpath.strip('/').split('/'):
+        match = re.fullmatch(r'([a-z0-9]+)(?:\[(\d+)\])?', step)
+        if not match:
+            return None
+        tag, index = match.group(1), int(match.group(2) or 1)
+
+        candidates = [child for child in node.element_children() if child.tag == tag]
+        if not candidates and tag == 'tbody':
+            continue
+        if index > len(candidates):
+            return None
+        node = candidates[index - 1]
+    return node
+
+
+def is_international_order(root):
+    """
+    Read the shipping country from a parsed order page
+
+    Returns:
+        True/False, or None if the cell is missing or doesn't hold a 2-letter country code
+        (e.g. the page layout moved and the XPath now lands on a label)
+    """
+    country_element = resolve_xpath(root, COUNTRY_XPATH)
+    if country_element is None:
+        return None
+
+    country_code = country_element.text().strip()
+    if not COUNTRY_CODE.match(country_code):
+        return None
+    return country_code.upper() != 'US'
+
+
+def find_card_widget(root, card_name, set_name, condition):
+    """
+    Find the widget matching card name, set name and condition (last match wins,
+    like the in-page helper)
+
+    Returns:
+        tuple: (widget Element or None, number of widgets on the page)
+    """
+    widgets = root.find_all(class_name='widget')
+    full_condition = CONDITION_MAP.get(condition, condition).lower()
+
+    target = None
+    for widget in widgets:
+        text = widget.text().lower()
+        if card_name.lower() in text and set_name.lower() in text and full_condition in text:
+            target = widget
+    return target, len(widgets)
+
+
+def partial_refund_href(widget, page_url):
+    """Absolute URL of the widget's Partial Refund link, or None if it has none"""
+    for link in widget.find_all('a'):
+        href = link.get('href') or ''
+        if 'partialrefund' in href:
+            return urljoin(page_url, href)
+    return None
+
+
+def widget_shows_refunded(widget):
+    """True if the widget's text positively marks the card as refunded"""
+    return bool(REFUNDED_MARKER.search(widget.text()))
+
+
+def refund_form_rows(root):
+    """
+    Product rows of a parsed Partial Refund form ('form table tbody tr')
+
+    Returns:
+        list of dicts: {'row': 1-based index, 'card_text': str, 'cost_text': str, 'quantity_input': name or None}
+    """
+    rows = []
+    seen = set()  # Nested tables would otherwise yield the same row twice
+    for form in root.find_all('form'):
+        for table in form.find_all('table'):
+            for tr in table.find_all('tr'):
+                # Header rows live in thead; body rows are what the in-page helper scans
+                if id(tr) in seen or tr.parent.tag == 'thead':
+                    continue
+                seen.add(id(tr))
+                cells = tr.element_children()
+                if len(cells) < 2 or cells[1].tag != 'td':
+                    continue
+
+                quantity_input = None
+                if len(cells) >= 8:
+                    inputs = cells[7].find_all('input')
+                    quantity_input = inputs[0].get('name') if inputs else None
+
+                rows.append({
+                    'row': len(rows) + 1,
+                    'card_text': cells[1].text(),
+                    'cost_text': cells[4].text().strip() if len(cells) >= 5 else '',
+                    'quantity_input': quantity_input,
+                })
+    return rows
+
+
+def find_form_row(rows, card_name):
+    """First refund form row whose card cell contains the card name, or None"""
+    card_name = card_name.lower()
+    for row in rows:
+        if card_name in row['card_text'].lower():
+            return row
+    return None
+
+
+def product_fields(root):
+    """
+    Hidden per-product inputs the form posts back (e.g. RefundProducts[0].TotalPrice)
+
+    Returns:
+        dict: product prefix like 'RefundProducts[0]' -> {field name: value}
+    """
+    products = {}
+    for element in root.find_all('input'):
+        if (element.get('type') or '').lower() != 'hidden':
+            continue
+        match = PRODUCT_FIELD.match(element.get('name') or '')
+        if match:
+            products.setdefault(match.group(1), {})[match.group(2)] = element.get('value') or ''
+    return products
+
+
+def parse_amount(value):
+    """Exact Decimal from a form value like "1.23", "$1,234.5" or "4"; None if it isn't a number"""
+    try:
+        amount = Decimal(value.replace('$', '').replace(',', '').strip())
+    except InvalidOperation:
+        return None
+    return amount.quantize(Decimal('0.01')) if amount.is_finite() else None
+
+
+def parse_cost(cost_text):
+    """Extract a cost like "$1.23" from cell text as an exact Decimal; None if there isn't one"""
+    match = COST_PATTERN.search(cost_text)
+    return Decimal(match.group(1).replace(',', '')) if match else None
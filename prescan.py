@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+HTTP pre-scan: triage refund rows before any browser work
+Fetches order pages (and Partial Refund forms) with the browser context's
+authenticated request API - no rendering, many requests in flight - and classifies
+every row so the browser pipeline only gets actionable rows plus prefilled data
+"""
+
+import asyncio
+import time
+from decimal import Decimal
+
+from page_parsing import (find_card_widget, find_form_row, is_international_order, parse_cost,
+                          parse_html, partial_refund_href, refund_form_rows, widget_shows_refunded)
+from refund_engine import compile_plan, parse_refund_row
+
+# Row statuses
+ACTIONABLE = 'actionable'  # Widget + Partial Refund link found; browser can go straight to the form
+REJECTED = 'rejected'      # Definitely can't be refunded (error_reason says why)
+UNKNOWN = 'unknown'        # HTML didn't tell us enough; browser handles it the normal way
+SKIPPED = 'skipped'        # Invalid row (same skip rules as the engine)
+
+
+async def fetch_page(request, url, semaphore):
+    """
+    GET a page with the shared session cookies
+
+    Returns:
+        dict: {'url': final URL, 'root': parsed Element or None, 'error': str or None}
+    """
+    async with semaphore:
+        try:
+            response = await request.get(url, timeout=30000)
+            if 'login' in response.url.lower():
+                return {'url': response.url, 'root': None, 'error': 'Not logged in'}
+            if not response.ok:
+                return {'url': response.url, 'root': None, 'error': f'HTTP {response.status}'}
+            html = await response.text()
+        except Exception as e:
+            return {'url': url, 'root': None, 'error': str(e).splitlines()[0]}
+
+    return {'url': response.url, 'root': parse_html(html), 'error': None}
+
+
+class PreScanner:
+    """
+    Classifies queue items from raw HTML
+    Each order page and form page is fetched once, even when several rows share it
+    """
+
+    def __init__(self, request, concurrency=16):
+        """
+        Args:
+            request: APIRequestContext (context.request) sharing the browser's login
+            concurrency: Maximum requests in flight
+        """
+        self.request = request
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self._pages = {}  # url -> Task resolving to fetch_page() result
+
+    @property
+    def pages_fetched(self):
+        return len(self._pages)
+
+    def _page(self, url):
+        if url not in self._pages:
+            self._pages[url] = asyncio.ensure_future(fetch_page(self.request, url, self.semaphore))
+        return self._pages[url]
+
+    async def scan_item(self, item):
+        """
+        Classify one queue item
+
+        Returns:
+            dict: {'status', 'error_reason', 'is_international', 'partial_refund_href', 'row_cost', 'note'}
+        """
+        result = {'status': UNKNOWN, 'error_reason': None, 'is_international': None,
+                  'partial_refund_href': None, 'row_cost': None, 'note': None}
+
+        row = parse_refund_row(item['refund'])
+        if row is None:
+            result['status'] = SKIPPED
+            return result
+
+        order_page = await self._page(row['order_url'])
+        if order_page['error']:
+            result['note'] = order_page['error']
+            return result
+
+        root = order_page['root']
+        result['is_international'] = is_international_order(root)
+        if result['is_international'] is None:
+            # Without a trusted country the browser opens the order page and reads it itself
+            result['note'] = 'Country not readable in page HTML'
+
+        widget, widget_count = find_card_widget(root, row['card_name'], row['set_name'], row['condition'])
+        if widget_count == 0:
+            # Widgets may be rendered client-side; let the browser decide
+            result['note'] = 'No widgets in page HTML'
+            return result
+        if widget is None:
+            result.update(status=REJECTED, error_reason='Card Not Found')
+            return result
+
+        href = partial_refund_href(widget, order_page['url'])
+        if not href:
+            if widget_shows_refunded(widget):
+                result.update(status=REJECTED, error_reason='Already Refunded')
+            else:
+                # The link may be added client-side; only a visible refunded marker is proof
+                result['note'] = 'No Partial Refund link in page HTML'
+            return result
+
+        result.update(status=ACTIONABLE, partial_refund_href=href)
+
+        # Row cost from the Partial Refund form (GET only renders the form)
+        form_page = await self._page(href)
+        if form_page['error']:
+            result['note'] = f"Form: {form_page['error']}"
+        else:
+            form_row = find_form_row(refund_form_rows(form_page['root']), row['card_name'])
+            if form_row:
+                result['row_cost'] = parse_cost(form_row['cost_text'])
+        return result
+
+    async def scan(self, queue):
+        """Classify every queue item concurrently; results are stored in item['prescan']"""
+        results = await asyncio.gather(*(self.scan_item(item) for item in queue))
+
+        claimed = set()
+        for item, result in zip(queue, results):
+            # Rows matching an already-claimed widget must re-check the live page, since the
+            # earlier row's refund may remove the link
+            href = result['partial_refund_href']
+            if href in claimed:
+                result.update(status=UNKNOWN, partial_refund_href=None, note='Shares widget with an earlier row')
+            elif href:
+                claimed.add(href)
+            item['prescan'] = result
+
+
+async def run_prescan(request, queue, concurrency=16):
+    """
+    Pre-scan the whole queue, add expected costs to the refund plan and print the planning report
+
+    Args:
+        request: APIRequestContext (context.request) sharing the browser's login
+        queue: list from build_work_queue(); each item gets a 'prescan' dict
+        concurrency: Maximum requests in flight
+    """
+    print(f"→ Pre-scanning {len(queue)} rows over HTTP ({concurrency} concurrent requests)...")
+    start = time.time()
+    scanner = PreScanner(request, concurrency)
+    await scanner.scan(queue)
+    elapsed = time.time() - start
+    compile_plan(queue)
+
+    print(f"✓ Pre-scan complete: {scanner.pages_fetched} pages fetched in {elapsed:.1f}s\n")
+    print_prescan_report(queue, elapsed)
+
+
+def print_prescan_report(queue, elapsed):
+    """Row triage, order country split and estimated costs for the actionable rows"""
+    statuses = {}
+    rejected = {}
+    notes = {}
+    orders = {}  # order_url -> is_international
+    refund_total = Decimal('0.00')
+    credit_total = Decimal('0.00')
+    costed_rows = 0
+
+    for item in queue:
+        prescan = item['prescan']
+        statuses[prescan['status']] = statuses.get(prescan['status'], 0) + 1
+        if prescan['status'] == SKIPPED:
+            continue
+
+        orders.setdefault(item['refund'].get('Order Link', '').strip(), prescan['is_international'])
+        if prescan['note']:
+            notes[prescan['note']] = notes.get(prescan['note'], 0) + 1
+        if prescan['status'] == REJECTED:
+            reason = prescan['error_reason']
+            rejected[reason] = rejected.get(reason, 0) + 1
+        elif prescan['status'] == ACTIONABLE:
+            if prescan['row_cost'] is not None:
+                refund_total += prescan['row_cost']
+                costed_rows += 1
+            if prescan['is_international'] is not None:
+                credit_total += item['plan']['international' if prescan['is_international'] else 'domestic'][
+                    'credit_amount']
+
+    actionable = statuses.get(ACTIONABLE, 0)
+    international = sum(1 for value in orders.values() if value)
+    domestic = sum(1 for value in orders.values() if value is False)
+
+    print(f"{'='*80}")
+    print("PRE-SCAN REPORT:")
+    print(f"  Rows: {len(queue)}")
+    for status in (ACTIONABLE, REJECTED, UNKNOWN, SKIPPED):
+        if statuses.get(status):
+            print(f"    - {status.capitalize()}: {statuses[status]}")
+
+    if rejected:
+        print(f"\n  Rejected Breakdown:")
+        for reason, count in sorted(rejected.items(), key=lambda x: x[1], reverse=True):
+            print(f"    - {reason}: {count}")
+
+    if notes:
+        print(f"\n  Notes:")
+        for note, count in sorted(notes.items(), key=lambda x: x[1], reverse=True):
+            print(f"    - {note}: {count}")
+
+    print(f"\n  Orders: {len(orders)}")
+    print(f"    - Domestic: {domestic}")
+    print(f"    - International: {international}")
+    if len(orders) - domestic - international:
+        print(f"    - Unknown country: {len(orders) - domestic - international}")
+
+    print(f"\n  Estimated Costs (actionable rows):")
+    print(f"    - Refund total: ${refund_total:.2f} ({costed_rows}/{actionable} rows with a cost)")
+    print(f"    - Store credit: ${credit_total:.2f}")
+    print(f"    - Cost to fix: ${refund_total + credit_total:.2f}")
+
+    if elapsed > 0:
+        print(f"\n  Pre-scan time: {elapsed:.1f}s ({len(queue)/elapsed:.0f} rows/s)")
+    print('='*80 + '\n')
@@ -0,0 +1,665 @@
+#!/usr/bin/env python3
+"""
+Browser-independent refund engine
+Row parsing, skip rules, the refund plan (credit owner + message/credit per row), cost math,
+result bookkeeping and the run summary. All page work goes through a driver
+(PlaywrightDriver in tcgplayer_direct_selectors.py, FakeDriver in fake_driver.py)
+"""
+
+import asyncio
+import csv
+import glob
+import json
+import os
+import tempfile
+import time
+from decimal import Decimal
+from pathlib import Path
+
+# Store credit amounts per SOP (all money is Decimal so sums are exact to the cent)
+NO_STORE_CREDIT = Decimal('0.00')
+DOMESTIC_STORE_CREDIT = Decimal('1.00')
+INTERNATIONAL_STORE_CREDIT = Decimal('5.99')
+
+# Plan/result fields holding money; JSON stores them as strings (see to_json/from_json)
+MONEY_FIELDS = ('credit_amount', 'original_amount', 'store_credit', 'cost_to_fix')
+
+DOMESTIC_CREDIT_MESSAGE = "TCGplayer is fully refunding this card due to an unfortunate inventory issue. We have applied an additional $1.00 in store credit to your TCGplayer account so you can purchase it from another Seller on our site. We're sorry for any inconvenience this may cause you."
+INTERNATIONAL_CREDIT_MESSAGE = "TCGplayer is fully refunding this card due to an unfortunate inventory issue. We have applied an additional $5.99 in store credit to your TCGplayer account so you can purchase it from another Seller on our site. We're sorry for any inconvenience this may cause you."
+NO_CREDIT_MESSAGE = "TCGplayer is fully refunding this card due to an unfortunate inventory issue. We're sorry for any inconvenience this may cause you."
+
+
+class RefundDriver:
+    """
+    Interface between the engine and whatever performs the page work
+    Every method maps to one step of the refund flow; drivers print their own details
+    """
+
+    def set_stage(self, stage):
+        """Called when the refund moves to a new stage (for profiling)"""
+
+    async def start_row(self):
+        """Called before each queue item (e.g. to start a debug capture)"""
+
+    async def finish_row(self, refund, result, touched_page=True):
+        """
+        Called with each queue item's result (e.g. to keep the capture only on failure)
+        touched_page is False when the row never reached the driver (rejected by the pre-scan)
+        """
+
+    async def open_order(self, order_url):
+        """Open the order page. Returns an error reason, or None on success"""
+        raise NotImplementedError
+
+    async def is_international(self):
+        """True if the open order ships outside the US"""
+        raise NotImplementedError
+
+    async def locate_partial_refund(self, card_name, set_name, condition):
+        """Find the card's widget. Returns (widget_found, partial_refund_href or None)"""
+        raise NotImplementedError
+
+    async def open_refund_form(self, partial_refund_href):
+        """Open the Partial Refund form. Returns an error reason, or None on success"""
+        raise NotImplementedError
+
+    async def fill_refund_form(self, refund_data):
+        """Fill the form and card row. Returns (success, total_cost, error_reason)"""
+        raise NotImplementedError
+
+    async def submit_refund(self):
+        """Submit the filled form. Returns True on success"""
+        raise NotImplementedError
+
+    async def add_store_credit(self, order_url, order_number):
+        """Add the international store credit for the order. Returns True on success"""
+        raise NotImplementedError
+
+
+def parse_refund_row(refund):
+    """
+    Extract the fields needed to process a CSV row, applying the skip rules
+
+    Returns:
+        dict with order_url, order_number, card_name, set_name, condition, quantity,
+        or None if the row should be skipped (bad link, no card name, bad quantity)
+    """
+    order_url = refund.get('Order Link', '').strip()
+
+    # Skip rows with invalid or missing order URLs
+    if not order_url or '#REF!' in order_url or not order_url.startswith('http'):
+        return None
+
+    # Handle different CSV formats - find card name column
+    card_name = None
+    for key in refund.keys():
+        if 'Card Name' in key:
+            card_name = refund[key]
+            break
+
+    if not card_name or not card_name.strip():
+        return None
+
+    # Skip rows with empty or invalid quantity
+    quant_str = refund.get('Quant.', '').strip()
+    if not quant_str:
+        return None
+
+    try:
+        quantity = abs(int(float(quant_str)))
+    except (ValueError, TypeError):
+        return None
+
+    # URL format: https://store.tcgplayer.com/admin/Direct/Order/251020-402C
+    order_number = refund.get('Order Number', '') or order_url.split('/')[-1]
+
+    return {
+        'order_url': order_url,
+        'order_number': order_number,
+        'card_name': card_name,
+        'set_name': refund.get('Set Name', ''),
+        'condition': refund.get('Cond.', ''),
+        'quantity': quantity,
+    }
+
+
+def store_credit_amount(is_international, is_credit_owner):
+    """Store credit owed for a row: only the order's credit owner gets credit"""
+    if not is_credit_owner:
+        return NO_STORE_CREDIT
+    return INTERNATIONAL_STORE_CREDIT if is_international else DOMESTIC_STORE_CREDIT
+
+
+def credit_decision(is_international, is_credit_owner):
+    """
+    Message, checkbox and credit for a row once its order's country is known
+    International credit is added manually on the buyer dashboard, so the checkbox
+    is only used for the domestic credit owner
+
+    Returns:
+        dict: {'message', 'store_credit', 'credit_amount', 'dashboard_credit'}
+    """
+    if is_international:
+        # Always use international message (no separate message for duplicate cards)
+        message = INTERNATIONAL_CREDIT_MESSAGE
+        store_credit = False
+    elif is_credit_owner:
+        message = DOMESTIC_CREDIT_MESSAGE
+        store_credit = True
+    else:
+        message = NO_CREDIT_MESSAGE
+        store_credit = False
+
+    return {
+        'message': message,
+        'store_credit': store_credit,
+        'credit_amount': store_credit_amount(is_international, is_credit_owner),
+        'dashboard_credit': is_international and is_credit_owner,
+    }
+
+
+def build_refund_data(card_name, quantity, decision):
+    """Refund form values for a row, from its credit_decision()"""
+    # Dropdown values are numeric IDs or exact text strings
+    return {
+        'refund_origin': '0',  # 0 = CSR Initiated, 1 = Seller Initiated, 2 = Buyer Initiated
+        'refund_reason': 'Product - Inventory Issue',  # Exact text from dropdown
+        'inventory_changes': 'True',  # True = Adjust Inventory, False = Do Not Adjust
+        'message': decision['message'],
+        'store_credit': decision['store_credit'],
+        'card_name': card_name,
+        'quantity': quantity
+    }
+
+
+def compute_costs(total_cost, decision):
+    """
+    Original Amount = total from the "Cost" column (already includes quantity)
+    Cost to Fix = Original Amount + Store Credit
+
+    Returns:
+        tuple: (original_amount, cost_to_fix) as Decimal, both None if the cost is unknown
+    """
+    if total_cost is None:
+        return None, None
+    return total_cost, total_cost + decision['credit_amount']
+
+
+def plan_entry(credit_owner, is_international=None, row_cost=None):
+    """
+    A row's refund plan: both country variants of its credit decision, plus the
+    expected costs when the country and Cost column are already known (from the pre-scan)
+
+    Returns:
+        dict: {'credit_owner', 'domestic', 'international', 'expected'}
+    """
+    entry = {
+        'credit_owner': credit_owner,
+        'domestic': credit_decision(False, credit_owner),
+        'international': credit_decision(True, credit_owner),
+        'expected': None,
+    }
+    if is_international is not None and row_cost is not None:
+        decision = entry['international' if is_international else 'domestic']
+        original_amount, cost_to_fix = compute_costs(row_cost, decision)
+        entry['expected'] = {
+            'is_international': is_international,
+            'original_amount': original_amount,
+            'store_credit': decision['credit_amount'],
+            'cost_to_fix': cost_to_fix,
+        }
+    return entry
+
+
+def to_json(value, **kwargs):
+    """json.dumps that writes Decimal money as exact strings"""
+    return json.dumps(value, default=str, **kwargs)
+
+
+def _decode_money(obj):
+    for field in MONEY_FIELDS:
+        # 'store_credit' is also the checkbox flag (a bool) in credit decisions
+        if isinstance(obj.get(field), str):
+            obj[field] = Decimal(obj[field])
+    return obj
+
+
+def from_json(text):
+    """json.loads for to_json() output, turning money fields back into Decimal"""
+    return json.loads(text, object_hook=_decode_money)
+
+
+def refund_result(success, elapsed=0, error_reason=None, is_international=False,
+                  original_amount=None, cost_to_fix=None, skipped=False):
+    """Outcome of one row, as returned by process_refund"""
+    return {
+        'success': success,
+        'skipped': skipped,
+        'elapsed': elapsed,
+        'error_reason': error_reason,
+        'is_international': is_international,
+        'original_amount': original_amount,
+        'cost_to_fix': cost_to_fix,
+    }
+
+
+def quiet(*args, **kwargs):
+    """Logger that discards output (for benchmarks)"""
+
+
+async def process_refund(driver, refund, plan=None, log=print, prescan=None):
+    """
+    Process a single refund from CSV row
+
+    Args:
+        driver: RefundDriver performing the page work
+        refund: dict with keys from CSV (Order Link, Card Name, Quant., etc.)
+        plan: dict from plan_entry() (via compile_plan) - decides message, checkbox and store
+            credit for this row; without one the row is treated as its order's credit owner
+        log: print-like function for progress output
+        prescan: optional dict from prescan.PreScanner - rejected rows never touch the
+            driver, actionable rows with a known country go straight to the refund form
+
+    Returns:
+        dict from refund_result()
+    """
+    start_time = time.time()
+
+    row = parse_refund_row(refund)
+    if row is None:
+        return refund_result(True, skipped=True)
+    if plan is None:
+        plan = plan_entry(True)
+
+    def failed(reason, label, is_international=False, original_amount=None, cost_to_fix=None):
+        elapsed = time.time() - start_time
+        log(f"✗ {label} ({elapsed:.1f}s)\n")
+        return refund_result(False, elapsed, reason, is_international, original_amount, cost_to_fix)
+
+    log(f"\n{'='*80}")
+    log(f"Order: {row['order_url']}")
+    log(f"Card: {row['card_name']}")
+    log(f"Set: {row['set_name']}")
+    log(f"Condition: {row['condition']}")
+    log(f"Quantity: {row['quantity']}")
+    log('='*80 + '\n')
+
+    prescan = prescan or {}
+    if prescan.get('error_reason'):
+        return failed(prescan['error_reason'], f"{prescan['error_reason'].upper()} - Rejected by pre-scan",
+                      bool(prescan.get('is_international')))
+
+    if prescan.get('partial_refund_href') and prescan.get('is_international') is not None:
+        # Pre-scan already read the country and found the widget's link
+        is_international = prescan['is_international']
+        partial_refund_href = prescan['partial_refund_href']
+        log(f"→ Using pre-scan: {'international' if is_international else 'domestic'} order, opening refund form directly\n")
+    else:
+        # Navigate to order page
+        log("→ Opening order page...")
+        driver.set_stage('order_load')
+        error_reason = await driver.open_order(row['order_url'])
+        if error_reason:
+            return failed(error_reason, f"{error_reason.upper()} - Order page failed to load")
+
+        # Check if order is international by reading shipping country
+        is_international = await driver.is_international()
+        if is_international:
+            log("→ International order detected\n")
+        else:
+            log("→ Domestic order detected\n")
+
+        # Isolate widget containing the card (match on name, set, condition)
+        widget_found, partial_refund_href = await driver.locate_partial_refund(
+            row['card_name'], row['set_name'], row['condition'])
+        if not widget_found:
+            return failed("Card Not Found", "CARD NOT FOUND - Widget isolation failed", is_international)
+        if not partial_refund_href:
+            return failed("Already Refunded", "ALREADY REFUNDED - Partial Refund button missing (card already processed)",
+                          is_international)
+
+    driver.set_stage('partial_refund_form')
+    error_reason = await driver.open_refund_form(partial_refund_href)
+    if error_reason:
+        return failed(error_reason, f"{error_reason.upper()} - Refund form did not load properly", is_international)
+
+    decision = plan['international' if is_international else 'domestic']
+    if decision['dashboard_credit']:
+        log("⚠️  INTERNATIONAL ORDER - Manual $5.99 store credit required!")
+        log("   After refund completes, navigate to customer page and add $5.99")
+        log("   Note: 'Product not in Direct Inventory Order #[ORDER_NUMBER]'\n")
+
+    refund_data = build_refund_data(row['card_name'], row['quantity'], decision)
+
+    # Fill form and the card's row (card name finds the correct row) and read its total cost
+    success, total_cost, fill_error = await driver.fill_refund_form(refund_data)
+    if not success:
+        return failed(fill_error, f"{fill_error.upper()} - Failed to fill refund form", is_international)
+    if total_cost is None:
+        total_cost = prescan.get('row_cost')
+
+    original_amount, cost_to_fix = compute_costs(total_cost, decision)
+    if original_amount is not None:
+        log(f"  💰 Original Amount: ${original_amount:.2f} (from Cost column)")
+        log(f"  💰 Store Credit: ${decision['credit_amount']:.2f}")
+        log(f"  💰 Cost to Fix: ${cost_to_fix:.2f}\n")
+    else:
+        log("  ⚠️  Warning: Could not extract cost for calculation\n")
+
+    expected = plan['expected']
+    if expected and (expected['is_international'] != is_international
+                     or (original_amount is not None and expected['original_amount'] != original_amount)):
+        log(f"  ⚠️  Differs from plan: expected ${expected['original_amount']:.2f} "
+            f"({'international' if expected['is_international'] else 'domestic'})\n")
+
+    driver.set_stage('submit')
+    if not await driver.submit_refund():
+        return failed("Submit Error", "SUBMIT ERROR - Failed to submit refund",
+                      is_international, original_amount, cost_to_fix)
+
+    # For international orders, add $5.99 store credit after refund
+    if decision['dashboard_credit']:
+        driver.set_stage('buyer_dashboard')
+        if not await driver.add_store_credit(row['order_url'], row['order_number']):
+            return failed("Store Credit Error", "STORE CREDIT ERROR - Failed to add international store credit",
+                          is_international, original_amount, cost_to_fix)
+
+    elapsed = time.time() - start_time
+    log(f"✓ Refund processed successfully ({elapsed:.1f}s)\n")
+    return refund_result(True, elapsed, None, is_international, original_amount, cost_to_fix)
+
+
+# Columns apply_result writes; everything else in a row is input
+RESULT_COLUMNS = ('Solved?', 'Original Amount', 'Cost to Fix')
+
+
+def apply_result(refund, result):
+    """Write a row's outcome into its CSV columns (skipped rows are left untouched)"""
+    if result['skipped']:
+        return
+
+    if result['success']:
+        # Mark as solved and add financial data
+        refund['Solved?'] = 'TRUE'
+        if result['original_amount'] is not None:
+            refund['Original Amount'] = f"${result['original_amount']:.2f}"
+        if result['cost_to_fix'] is not None:
+            refund['Cost to Fix'] = f"${result['cost_to_fix']:.2f}"
+    else:
+        # Mark as failed with error reason
+        error_reason = result['error_reason']
+        refund['Solved?'] = f'FAILED: {error_reason}' if error_reason else 'FAILED'
+
+
+class RunStats:
+    """Counters and timings for a run, printed as the end-of-run summary"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.success_count = 0
+        self.failed_count = 0
+        self.domestic_times = []
+        self.international_times = []
+        self.error_categories = {}  # Track error reasons
+
+    def record(self, result):
+        if result['skipped']:
+            return
+
+        if result['success']:
+            self.success_count += 1
+            # Track domestic vs international
+            if result['is_international']:
+                self.international_times.append(result['elapsed'])
+            else:
+                self.domestic_times.append(result['elapsed'])
+        else:
+            self.failed_count += 1
+            if result['error_reason']:
+                reason = result['error_reason']
+                self.error_categories[reason] = self.error_categories.get(reason, 0) + 1
+
+    def print_summary(self, total_rows):
+        total_time = time.time() - self.started
+        skipped_count = total_rows - self.success_count - self.failed_count
+        times = self.domestic_times + self.international_times
+
+        print(f"\n{'='*80}")
+        print(f"SUMMARY:")
+        print(f"  Success: {self.success_count}/{total_rows} refunds processed")
+
+        # Domestic vs International breakdown
+        if self.domestic_times or self.international_times:
+            print(f"\n  Order Type Breakdown:")
+            if self.domestic_times:
+                print(f"    - Domestic: {len(self.domestic_times)}")
+            if self.international_times:
+                print(f"    - International: {len(self.international_times)}")
+
+        if self.failed_count > 0:
+            print(f"\n  Failed: {self.failed_count} refunds")
+            if self.error_categories:
+                print(f"\n  Failure Breakdown:")
+                for error_type, count in sorted(self.error_categories.items(), key=lambda x: x[1], reverse=True):
+                    print(f"    - {error_type}: {count}")
+        if skipped_count > 0:
+            print(f"\n  Skipped: {skipped_count} invalid rows")
+
+        print(f"\nTiming Statistics:")
+        print(f"  Total time: {total_time:.1f}s ({total_time/60:.1f}m)")
+
+        # Guard against zero averages (fake drivers finish rows in ~0s)
+        for label, values in (('Overall', times), ('Domestic', self.domestic_times),
+                              ('International', self.international_times)):
+            if values:
+                avg = sum(values) / len(values)
+                prefix = '' if label == 'Overall' else '\n'
+                print(f"{prefix}  {label} average: {avg:.1f}s per refund")
+                if avg > 0:
+                    print(f"  {label} rate: {3600/avg:.0f} refunds/hour")
+
+        print('='*80)
+
+
+async def save_csv_progress(csv_path, refunds, fieldnames):
+    """
+    Save updated CSV with current progress
+
+    Args:
+        csv_path: Path to CSV file
+        refunds: List of refund dicts with updated status
+        fieldnames: Original CSV column names
+    """
+    # Write to a temp file and swap it in, so a crash (or another node reading the
+    # file on shared storage) never sees a half-written CSV. The temp name is unique
+    # per writer, so nodes exporting the same CSV at once don't truncate each other's
+    csv_path = Path(csv_path)
+    with tempfile.NamedTemporaryFile('w', newline='', dir=csv_path.parent, prefix=csv_path.name + '.',
+                                     suffix='.tmp', delete=False) as f:
+        tmp_path = f.name
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(refunds)
+    try:
+        # Temp files are created 0600; keep the CSV readable by the other nodes
+        os.chmod(tmp_path, csv_path.stat().st_mode & 0o777 if csv_path.exists() else 0o644)
+        os.replace(tmp_path, csv_path)
+    except OSError:
+        os.unlink(tmp_path)
+        raise
+    print("✓ CSV progress saved")
+
+
+def expand_csv_paths(csv_files):
+    """
+    Expand CSV arguments (plain paths or glob patterns) into a list of unique paths
+    Keeps argument order; glob matches are sorted for a stable processing order
+    """
+    paths = []
+    seen = set()
+    for pattern in csv_files:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        if not matches:
+            print(f"✗ No CSV files match: {pattern}")
+        for match in matches:
+            path = Path(match)
+            if path.resolve() not in seen:
+                seen.add(path.resolve())
+                paths.append(path)
+    return paths
+
+
+def load_csv_sources(csv_paths):
+    """
+    Read every CSV into a source dict: {'path', 'fieldnames', 'refunds'}
+    Missing files are reported and skipped
+    """
+    sources = []
+    for csv_path in csv_paths:
+        if not csv_path.exists():
+            print(f"✗ CSV file not found: {csv_path}")
+            continue
+
+        with open(csv_path, 'r') as f:
+            reader = csv.DictReader(f)
+            sources.append({
+                'path': csv_path,
+                'fieldnames': reader.fieldnames,
+                'refunds': list(reader),
+            })
+    return sources
+
+
+def order_key(refund):
+    """
+    Identify the order a row belongs to, independent of which CSV it came from
+    Uses the last segment of the order link (e.g. 251020-402C), falling back to Order Number
+    """
+    order_url = refund.get('Order Link', '').strip().rstrip('/')
+    key = order_url.split('/')[-1] if order_url else refund.get('Order Number', '').strip()
+    return key.upper()
+
+
+def build_work_queue(sources):
+    """
+    Merge rows from all sources into one queue grouped by order, with its refund plan compiled
+
+    Orders keep the position of their first appearance (across files, in argument order)
+    and all of an order's rows run back to back.
+
+    Returns:
+        list of dicts: {'source': source dict, 'source_row': index in source['refunds'],
+                        'refund': CSV row, 'order_key': str, 'plan': dict or None}
+    """
+    orders = {}
+    for source in sources:
+        for index, refund in enumerate(source['refunds']):
+            key = order_key(refund)
+            # Rows without an order get their own group (they are skipped later anyway)
+            orders.setdefault(key if key else object(), []).append(
+                {'source': source, 'source_row': index, 'refund': refund, 'order_key': key})
+
+    queue = [item for group in orders.values() for item in group]
+    compile_plan(queue)
+    return queue
+
+
+def compile_plan(queue):
+    """
+    Make every decision that depends on other rows up front, so plan entries can run
+    in any order or on any node with the same financial outcome as a serial run
+
+    Each order's credit owner is its first valid row in queue order (file order, as built
+    by build_work_queue), so an order split across two logs is only credited once and a
+    skipped row never takes the credit. Sets item['plan'] (None for skipped rows); items
+    with a pre-scan result also get expected costs. Safe to call again after a pre-scan.
+
+    Returns:
+        int: number of orders with a credit owner
+    """
+    owners = set()
+    for item in queue:
+        if parse_refund_row(item['refund']) is None:
+            item['plan'] = None
+            continue
+        prescan = item.get('prescan') or {}
+        credit_owner = item['order_key'] not in owners
+        owners.add(item['order_key'])
+        item['plan'] = plan_entry(credit_owner, prescan.get('is_international'), prescan.get('row_cost'))
+    return len(owners)
+
+
+def write_plan(queue, plan_path):
+    """Write the compiled plan as JSON (one entry per queue item, skipped rows included)"""
+    entries = []
+    for item in queue:
+        # Same card column rule as the engine (any column containing "Card Name"); skipped rows have none
+        row = parse_refund_row(item['refund']) if item['plan'] is not None else None
+        entries.append({
+            'source': Path(item['source']['path']).name,
+            'row': item['source_row'] + 2,  # Spreadsheet row number (header is row 1)
+            'order': item['order_key'],
+            'card_name': row['card_name'].strip() if row else '',
+            'plan': item['plan'],
+        })
+    with open(plan_path, 'w') as f:
+        f.write(to_json(entries, indent=2))
+    print(f"✓ Refund plan written to {plan_path}")
+
+
+async def run_item(driver, item, stats, log=print):
+    """
+    Process one queue item through the driver hooks and record its result
+    into the CSV row and stats
+
+    Returns:
+        dict from refund_result()
+    """
+    await driver.start_row()
+    result = await process_refund(driver, item['refund'], item['plan'], log, item.get('prescan'))
+    touched_page = not (item.get('prescan') or {}).get('error_reason')
+    await driver.finish_row(item['refund'], result, touched_page)
+
+    stats.record(result)
+    apply_result(item['refund'], result)
+    return result
+
+
+async def run_queue(driver, queue, stats, save_progress=True, delay=2, log=print):
+    """
+    Process every queue item in order, recording results into the CSV rows and stats
+
+    Args:
+        driver: RefundDriver performing the page work
+        queue: list from build_work_queue()
+        stats: RunStats to record results into
+        save_progress: If True, rewrite the item's source CSV after every processed row
+        delay: Seconds to wait between refunds
+        log: print-like function for progress output
+    """
+    try:
+        for i, item in enumerate(queue, 1):
+            source = item['source']
+
+            log(f"\n{'#'*80}")
+            log(f"Refund {i}/{len(queue)} ({Path(source['path']).name})")
+            log('#'*80)
+
+            result = await run_item(driver, item, stats, log)
+
+            if result['skipped']:
+                continue
+
+            if save_progress:
+                await save_csv_progress(source['path'], source['refunds'], source['fieldnames'])
+
+            # Rows rejected by the pre-scan never opened a page, so no need to pace them
+            if item.get('prescan', {}).get('error_reason'):
+                continue
+
+            # Small delay between refunds
+            driver.set_stage('idle')
+            if delay:
+                await asyncio.sleep(delay)
+    except KeyboardInterrupt:
+        print("\n\n⚠️  Process interrupted by user (Ctrl+C)")
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Refund form costs captured from network responses
+The Partial Refund form's HTML already arrives as the document response. It is
+parsed off the rendering path and every product row's Cost is indexed by the
+row's refund quantity input, so reading a row's cost is a dict lookup that doesn't
+wait for the rendered table
+"""
+
+import asyncio
+from urllib.parse import urldefrag
+
+from page_parsing import (PRODUCT_FIELD, parse_amount, parse_cost, parse_html, product_fields,
+                          refund_form_rows)
+
+
+# Hidden per-product fields that would hold the line total (qty x unit price). These
+# names are not confirmed on the live form, so they are only a fallback for an
+# unreadable Cost cell and a cross-check - never trusted over the Cost column
+TOTAL_FIELDS = ('TotalPrice', 'TotalCost', 'ExtendedPrice', 'LineTotal')
+
+
+def form_costs(root):
+    """
+    Cost of every product row in a parsed Partial Refund form, from its Cost cell
+    A hidden per-product total (same prefix as the row's quantity input, e.g.
+    RefundProducts[0].TotalPrice) is used only when the cell has no amount, and a
+    disagreement between the two is reported
+
+    Returns:
+        dict: quantity input name -> Decimal cost (None if neither has an amount)
+    """
+    products = product_fields(root)
+    costs = {}
+    for row in refund_form_rows(root):
+        if not row['quantity_input']:
+            continue
+        match = PRODUCT_FIELD.match(row['quantity_input'])
+        fields = products.get(match.group(1), {}) if match else {}
+
+        hidden_cost = None
+        for field in TOTAL_FIELDS:
+            hidden_cost = parse_amount(fields.get(field, ''))
+            if hidden_cost is not None:
+                break
+
+        cost = parse_cost(row['cost_text'])
+        if cost is None:
+            cost = hidden_cost
+        elif hidden_cost is not None and hidden_cost != cost:
+            print(f"  ⚠ {row['quantity_input']}: Cost column ${cost:.2f} but hidden {field} ${hidden_cost:.2f}"
+                  " - using the Cost column")
+        costs[row['quantity_input']] = cost
+    return costs
+
+
+class ResponseCostIndex:
+    """
+    Indexes Partial Refund form costs as the browser receives the form documents
+
+    Usage:
+        costs = ResponseCostIndex()
+        costs.attach(context)
+        ...  # page navigates to a Partial Refund form
+        cost = await costs.lookup(page.url, quantity_input_name)
+    """
+
+    def __init__(self, max_forms=20):
+        """
+        Args:
+            max_forms: Most recent forms kept (older ones are dropped)
+        """
+        self.max_forms = max_forms
+        self._forms = {}  # form URL -> Task resolving to form_costs() result, or None if unreadable
+
+    def attach(self, context):
+        """Subscribe to responses on every page of the context"""
+        context.on('response', self._on_response)
+
+    def _on_response(self, response):
+        if response.request.resource_type != 'document' or 'partialrefund' not in response.url.lower():
+            return
+
+        url = urldefrag(response.url)[0]
+        self._forms.pop(url, None)  # A reload replaces the old entry and moves it to the end
+        self._forms[url] = asyncio.ensure_future(self._parse(response))
+        while len(self._forms) > self.max_forms:
+            del self._forms[next(iter(self._forms))]
+
+    async def _parse(self, response):
+        try:
+            if not response.ok:
+                return None
+            return form_costs(parse_html(await response.text()))
+        except Exception as e:
+            print(f"  ⚠ Could not read refund form response: {e}")
+            return None
+
+    async def lookup(self, form_url, product_key):
+        """
+        Cost of one product row on a form the browser has loaded
+
+        Args:
+            form_url: URL of the Partial Refund form (page.url)
+            product_key: The row's quantity input name, as reported by the in-page helper
+
+        Returns:
+            Decimal or None if the form response or row cost wasn't captured
+        """
+        task = self._forms.get(urldefrag(form_url)[0])
+        if task is None or not product_key:
+            return None
+        costs = await task
+        return costs.get(product_key) if costs else None
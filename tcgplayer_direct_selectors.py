@@ -4,13 +4,20 @@ TCGPlayer refund automation using direct Playwright selectors
 Replaces AI with JavaScript widget isolation + CSS selectors for speed
 """
 
+import argparse
 import asyncio
 import os
-import time
 from pathlib import Path
 from dotenv import load_dotenv
 from playwright.async_api import async_playwright
-import csv
+from failure_capture import FailureCapture
+from lease_store import LeaseStore, LeaseStoreError, export_results, run_leased
+from network_profiler import NetworkProfiler
+from page_parsing import parse_cost
+from prescan import run_prescan
+from refund_engine import (RefundDriver, RunStats, build_work_queue, expand_csv_paths, write_plan,
+                           load_csv_sources, run_queue)
+from response_capture import ResponseCostIndex
 
 load_dotenv('.env.local')
 
@@ -169,39 +176,52 @@ async def login_to_tcgplayer(page):
         print("✓ Already logged in\n")
 
 
-async def isolate_widget(page, card_name, set_name, condition):
-    """
-    Isolate widget containing the target card using JavaScript
-    Matches on card name, set name, and condition to handle duplicate cards
-    Returns True if widget found and isolated, False otherwise
-    """
-    # Pass all identifying info as parameters to avoid string escaping issues
-    isolation_script = """
-    ({cardName, setName, condition}) => {
-        const widgets = document.querySelectorAll('.widget');
-        let targetWidget = null;
+# In-page helper library, installed once per browser context with add_init_script
+# Each composite operation runs in a single page.evaluate round-trip
+REFUND_HELPERS_SCRIPT = """
+(() => {
+    if (window.__refundHelpers) return;
+
+    // Normalize condition text (CSV uses abbreviations, page uses full text)
+    const conditionMap = {
+        'NM': 'Near Mint',
+        'LP': 'Lightly Played',
+        'MP': 'Moderately Played',
+        'HP': 'Heavily Played',
+        'DM': 'Damaged',
+        // Foil variants
+        'NMF': 'Near Mint Foil',
+        'LPF': 'Lightly Played Foil',
+        'MPF': 'Moderately Played Foil',
+        'HPF': 'Heavily Played Foil',
+        'DMF': 'Damaged Foil',
+        // Pokemon holofoil variants
+        'NMH': 'Near Mint Holofoil',
+        'LPH': 'Lightly Played Holofoil',
+        'MPH': 'Moderately Played Holofoil',
+        'HPH': 'Heavily Played Holofoil',
+        'DMH': 'Damaged Holofoil'
+    };
+
+    function fireInputEvents(element) {
+        element.dispatchEvent(new Event('input', { bubbles: true }));
+        element.dispatchEvent(new Event('change', { bubbles: true }));
+    }
+
+    // Select by option value or visible text (same matching as Playwright's select_option)
+    function selectOption(select, wanted) {
+        const option = Array.from(select.options).find(o => o.value === wanted || o.text.trim() === wanted);
+        if (!option) return false;
+        select.value = option.value;
+        fireInputEvents(select);
+        return true;
+    }
 
-        // Normalize condition text (CSV uses abbreviations, page uses full text)
-        const conditionMap = {
-            'NM': 'Near Mint',
-            'LP': 'Lightly Played',
-            'MP': 'Moderately Played',
-            'HP': 'Heavily Played',
-            'DM': 'Damaged',
-            // Foil variants
-            'NMF': 'Near Mint Foil',
-            'LPF': 'Lightly Played Foil',
-            'MPF': 'Moderately Played Foil',
-            'HPF': 'Heavily Played Foil',
-            'DMF': 'Damaged Foil',
-            // Pokemon holofoil variants
-            'NMH': 'Near Mint Holofoil',
-            'LPH': 'Lightly Played Holofoil',
-            'MPH': 'Moderately Played Holofoil',
-            'HPH': 'Heavily Played Holofoil',
-            'DMH': 'Damaged Holofoil'
-        };
+    // Locate the widget for card/set/condition, isolate it, and return its Partial Refund link
+    function locatePartialRefund({cardName, setName, condition}) {
+        const widgets = document.querySelectorAll('.widget');
         const fullCondition = conditionMap[condition] || condition;
+        let targetWidget = null;
 
         widgets.forEach(w => {
             const text = w.textContent.toLowerCase();
@@ -216,207 +236,177 @@ async def isolate_widget(page, card_name, set_name, condition):
 
         if (!targetWidget) {
             return {
-                success: false,
+                widgetFound: false,
+                href: null,
                 message: `No widget found with card="${cardName}", set="${setName}", condition="${fullCondition}"`
             };
         }
 
-        // Hide all other widgets
+        // Hide all other widgets and the order information
         widgets.forEach(w => {
             if (w !== targetWidget) {
                 w.style.display = 'none';
             }
         });
-
-        // Hide order information
         const orderInfo = document.querySelector('.orderInformation');
         if (orderInfo) orderInfo.style.display = 'none';
 
-        return { success: true, message: 'Widget isolated' };
-    }
-    """
+        // Find Partial Refund button WITHIN the target widget
+        const partialRefundButton = targetWidget.querySelector('a[href*="partialrefund"]');
+        if (!partialRefundButton) {
+            return { widgetFound: true, href: null, message: 'Partial Refund button not found in widget' };
+        }
 
-    result = await page.evaluate(isolation_script, {
-        'cardName': card_name,
-        'setName': set_name,
-        'condition': condition
-    })
+        return { widgetFound: true, href: partialRefundButton.href, message: 'Widget isolated, Partial Refund link found' };
+    }
 
-    if result['success']:
-        print(f"✓ {result['message']}")
-        return True
-    else:
-        print(f"✗ {result['message']}")
-        return False
+    // Fill dropdowns, message, store credit checkbox and the card's quantity row
+    // Returns the row's quantity input name so the cost can be looked up from the form response,
+    // plus the Cost cell's raw text (td[5]) as a fallback when the response had no cost
+    function fillRefundForm(data) {
+        const steps = [];
+        const fail = (field, message) => ({ success: false, field, message, steps, productKey: null, costText: null });
+
+        const origin = document.querySelector('select#refundOrigin');
+        if (!origin || !selectOption(origin, data.refundOrigin)) return fail('form', `Refund Origin "${data.refundOrigin}" not available`);
+        steps.push(`Refund Origin: ${data.refundOrigin}`);
+
+        const reason = document.querySelector('select#refundReason');
+        if (!reason || !selectOption(reason, data.refundReason)) return fail('form', `Refund Reason "${data.refundReason}" not available`);
+        steps.push(`Refund Reason: ${data.refundReason}`);
+
+        // Inventory Changes is optional - skip if not present
+        const inventory = document.querySelector('select#inventoryChanges');
+        const inventorySet = inventory && selectOption(inventory, data.inventoryChanges);
+
+        const message = document.querySelector('textarea#Message');
+        if (!message) return fail('form', 'Message textarea not found');
+        message.value = data.message;
+        fireInputEvents(message);
+        steps.push(`Message: ${data.message.slice(0, 50)}...`);
+
+        const storeCredit = document.querySelector('input#AddCsrStoreCredit');
+        if (!storeCredit) return fail('form', 'Store credit checkbox not found');
+        if (storeCredit.checked !== data.storeCredit) storeCredit.click();
+        steps.push(`Store credit: ${data.storeCredit ? 'checked' : 'unchecked'}`);
+
+        // Find the table row containing the card name (handles sub-orders with multiple cards)
+        const rows = document.querySelectorAll('form table tbody tr');
+        for (let i = 0; i < rows.length; i++) {
+            const row = rows[i];
+            const cardCell = row.querySelector('td:nth-child(2)');
+            if (!cardCell || !cardCell.textContent.toLowerCase().includes(data.cardName.toLowerCase())) continue;
 
+            const costCell = row.querySelector('td:nth-child(5)');
 
-async def click_partial_refund(page):
-    """
-    Click the Partial Refund button in the isolated widget
-    Uses scoped query to find button within isolated widget only
-    """
-    click_script = """
-    (function() {
-        // Find the visible widget (all others are hidden)
-        const widgets = document.querySelectorAll('.widget');
-        let targetWidget = null;
+            // Fill quantity input (Column 8: "Refund Quantity")
+            const quantityInput = row.querySelector('td:nth-child(8) input');
+            if (!quantityInput) return fail('quantity', `Card found in row ${i + 1} but no quantity input`);
+            quantityInput.value = data.quantity;
+            fireInputEvents(quantityInput);
 
-        for (const w of widgets) {
-            if (w.style.display !== 'none') {
-                targetWidget = w;
-                break;
-            }
+            return {
+                success: true,
+                inventoryChanges: Boolean(inventorySet),
+                message: `Found card in row ${i + 1}, set quantity to ${data.quantity}`,
+                steps,
+                productKey: quantityInput.name || null,
+                costText: costCell ? costCell.textContent.trim() : null
+            };
         }
 
-        if (!targetWidget) {
-            return { success: false, message: 'No visible widget found' };
-        }
+        return fail('quantity', `Card "${data.cardName}" not found in table`);
+    }
 
-        // Find Partial Refund button WITHIN the target widget
-        const partialRefundButton = targetWidget.querySelector('a[href*="partialrefund"]');
+    window.__refundHelpers = { conditionMap, locatePartialRefund, fillRefundForm };
+})();
+"""
 
-        if (!partialRefundButton) {
-            return { success: false, message: 'Partial Refund button not found in widget' };
-        }
 
-        partialRefundButton.click();
-        return { success: true, message: 'Clicked Partial Refund button' };
-    })();
+async def install_refund_helpers(context):
+    """Register the in-page helper library for every document the context loads"""
+    await context.add_init_script(script=REFUND_HELPERS_SCRIPT)
+
+
+async def call_refund_helper(page, name, args):
+    """
+    Run one composite helper operation in a single round-trip
+    Falls back to installing the library into the current document if it is missing
+    (e.g. the page was loaded before install_refund_helpers was called)
     """
+    call_script = "([name, args]) => window.__refundHelpers ? window.__refundHelpers[name](args) : null"
 
-    result = await page.evaluate(click_script)
+    result = await page.evaluate(call_script, [name, args])
+    if result is None:
+        await page.evaluate(REFUND_HELPERS_SCRIPT)
+        result = await page.evaluate(call_script, [name, args])
+    return result
 
-    if result['success']:
+
+async def locate_partial_refund(page, card_name, set_name, condition):
+    """
+    Isolate the widget containing the target card and return its Partial Refund link
+    Matches on card name, set name, and condition to handle duplicate cards
+
+    Returns:
+        tuple: (widget_found: bool, partial_refund_href: str or None)
+    """
+    result = await call_refund_helper(page, 'locatePartialRefund', {
+        'cardName': card_name,
+        'setName': set_name,
+        'condition': condition
+    })
+
+    if result['href']:
         print(f"✓ {result['message']}")
-        return True
     else:
         print(f"✗ {result['message']}")
-        return False
+    return result['widgetFound'], result['href']
 
 
 async def fill_refund_form(page, refund_data):
     """
-    Fill refund form using direct Playwright selectors
-    No AI needed - all elements have stable IDs
+    Fill the whole refund form and the card's quantity row in one round-trip
 
     Args:
         refund_data: dict with keys:
             - refund_origin: str (dropdown value)
-            - refund_reason: str (dropdown value)
+            - refund_reason: str (dropdown value or text)
             - inventory_changes: str (dropdown value)
             - message: str (textarea text)
             - store_credit: bool (checkbox)
+            - card_name: str (used to find the card's row in the product table)
             - quantity: int (number of cards to refund)
+
+    Returns:
+        tuple: (success: bool, product_key: quantity input name or None,
+                cost_text: the row's rendered Cost cell text or None, error_reason: str or None)
     """
     print("→ Filling refund form...")
 
-    # Wait for form to load
-    await page.wait_for_selector('select#refundOrigin', timeout=5000)
+    result = await call_refund_helper(page, 'fillRefundForm', {
+        'refundOrigin': refund_data['refund_origin'],
+        'refundReason': refund_data['refund_reason'],
+        'inventoryChanges': refund_data['inventory_changes'],
+        'message': refund_data['message'],
+        'storeCredit': refund_data['store_credit'],
+        'cardName': refund_data['card_name'],
+        'quantity': refund_data['quantity']
+    })
 
-    # Fill Refund Origin dropdown
-    await page.select_option('select#refundOrigin', refund_data['refund_origin'])
-    print(f"  ✓ Refund Origin: {refund_data['refund_origin']}")
+    for step in result['steps']:
+        print(f"  ✓ {step}")
 
-    # Fill Refund Reason dropdown
-    await page.select_option('select#refundReason', refund_data['refund_reason'])
-    print(f"  ✓ Refund Reason: {refund_data['refund_reason']}")
+    if not result['success']:
+        print(f"  ✗ {result['message']}")
+        reason = "Form Fill Error" if result['field'] == 'form' else "Quantity Fill Error"
+        return False, None, None, reason
 
-    # Fill Inventory Changes dropdown (optional - skip if not present)
-    try:
-        await page.select_option('select#inventoryChanges', refund_data['inventory_changes'], timeout=2000)
-        print(f"  ✓ Inventory Changes: {refund_data['inventory_changes']}")
-    except:
+    if not result['inventoryChanges']:
         print("  ⚠ Inventory Changes: field not available, skipping")
-
-    # Fill message textarea
-    await page.fill('textarea#Message', refund_data['message'])
-    print(f"  ✓ Message: {refund_data['message'][:50]}...")
-
-    # Store credit checkbox
-    if refund_data['store_credit']:
-        await page.check('input#AddCsrStoreCredit')
-        print("  ✓ Store credit: checked")
-    else:
-        await page.uncheck('input#AddCsrStoreCredit')
-        print("  ✓ Store credit: unchecked")
-
-    # Fill quantity for first row (RefundProducts[0].RefundQuantity)
-    # Note: If multiple cards in sub-order, need to find correct row by card name
-    quantity_input = 'input#RefundProducts_0__RefundQuantity'
-    await page.fill(quantity_input, str(refund_data['quantity']))
-    print(f"  ✓ Quantity: {refund_data['quantity']}")
-
+    print(f"  ✓ {result['message']}")
     print("✓ Form filled\n")
-
-
-async def find_card_row_and_fill_quantity(page, card_name, quantity):
-    """
-    Find the table row containing the card name and fill its quantity input
-    Also extracts the total cost from the Cost column (td[5])
-    Note: Cost column already includes quantity calculation (qty × unit price)
-    Handles sub-orders with multiple cards by searching table for card name
-
-    Returns:
-        tuple: (success: bool, total_cost: float or None)
-    """
-    # Pass card name as parameter to avoid string escaping issues
-    script = """
-    ({cardName, quantity}) => {
-        // Find all table rows
-        const rows = document.querySelectorAll('form table tbody tr');
-
-        for (let i = 0; i < rows.length; i++) {
-            const row = rows[i];
-            const cardCell = row.querySelector('td:nth-child(2)');
-
-            if (!cardCell) continue;
-
-            const cellText = cardCell.textContent.toLowerCase();
-            if (cellText.includes(cardName.toLowerCase())) {
-                // Found the card row - extract total cost from td[5]
-                // Note: This is the total (qty × unit price), not unit price
-                const costCell = row.querySelector('td:nth-child(5)');
-                let totalCost = null;
-                if (costCell) {
-                    // Extract cost - format is typically "$1.23"
-                    const costText = costCell.textContent.trim();
-                    const costMatch = costText.match(/\$?([0-9]+\.[0-9]{2})/);
-                    if (costMatch) {
-                        totalCost = parseFloat(costMatch[1]);
-                    }
-                }
-
-                // Fill quantity input (Column 8: "Refund Quantity")
-                const quantityInput = row.querySelector('td:nth-child(8) input');
-
-                if (quantityInput) {
-                    quantityInput.value = quantity;
-                    // Trigger change event
-                    quantityInput.dispatchEvent(new Event('change', { bubbles: true }));
-                    return {
-                        success: true,
-                        message: `Found card in row ${i + 1}, set quantity to ${quantity}, total cost: $${totalCost}`,
-                        inputName: quantityInput.name,
-                        totalCost: totalCost
-                    };
-                } else {
-                    return { success: false, message: `Card found in row ${i + 1} but no quantity input`, totalCost: null };
-                }
-            }
-        }
-
-        return { success: false, message: `Card "${cardName}" not found in table`, totalCost: null };
-    }
-    """
-
-    result = await page.evaluate(script, {'cardName': card_name, 'quantity': quantity})
-
-    if result['success']:
-        print(f"  ✓ {result['message']}")
-        return True, result.get('totalCost')
-    else:
-        print(f"  ✗ {result['message']}")
-        return False, None
+    return True, result['productKey'], result['costText'], None
 
 
 async def submit_refund(page, dry_run=True):
@@ -464,260 +454,166 @@ async def submit_refund(page, dry_run=True):
         return False
 
 
-async def process_single_refund(page, refund, is_first_card=True):
+class PlaywrightDriver(RefundDriver):
     """
-    Process a single refund from CSV row
-
-    Args:
-        refund: dict with keys from CSV (Order Link, Card Name, Quant., etc.)
-        is_first_card: bool - True if this is the first card in the order (gets $1 credit)
-
-    Returns:
-        tuple: (success: bool, elapsed_time: float, error_reason: str or None)
+    Runs the refund flow in a real browser page
+    Wraps the Playwright helpers above; the engine decides what to do with the results
     """
-    start_time = time.time()
-
-    order_url = refund.get('Order Link', '').strip()
-
-    # Skip rows with invalid or missing order URLs
-    if not order_url or '#REF!' in order_url or not order_url.startswith('http'):
-        return True, 0, None, False, None, None
-
-    # Handle different CSV formats - find card name column
-    card_name = None
-    for key in refund.keys():
-        if 'Card Name' in key:
-            card_name = refund[key]
-            break
-
-    if not card_name or not card_name.strip():
-        # Skip empty rows
-        return True, 0, None, False, None, None
-
-    # Extract set name and condition from CSV
-    set_name = refund['Set Name']
-    condition = refund['Cond.']
-
-    # Skip rows with empty quantity
-    quant_str = refund.get('Quant.', '').strip()
-    if not quant_str:
-        # Skip rows with empty quantity
-        return True, 0, None, False, None, None
-
-    try:
-        quantity = abs(int(float(quant_str)))
-    except (ValueError, TypeError):
-        # Skip rows with invalid quantity
-        return True, 0, None, False, None, None
-
-    print(f"\n{'='*80}")
-    print(f"Order: {order_url}")
-    print(f"Card: {card_name}")
-    print(f"Set: {set_name}")
-    print(f"Condition: {condition}")
-    print(f"Quantity: {quantity}")
-    print('='*80 + '\n')
-
-    # Navigate to order page
-    print(f"→ Opening order page...")
-    try:
-        await page.goto(order_url, timeout=30000)
-        await page.wait_for_load_state("networkidle", timeout=30000)
-        await asyncio.sleep(1)  # Let dynamic content load
-        print("✓ Order page loaded\n")
-    except Exception as e:
-        elapsed = time.time() - start_time
-        error_msg = str(e).lower()
-
-        # Categorize the error
-        if 'timeout' in error_msg:
-            if 'net::err' in error_msg or 'navigation' in error_msg:
-                reason = "Already Refunded"
-                print(f"✗ ALREADY REFUNDED - Order page failed to load ({elapsed:.1f}s)\n")
-            else:
-                reason = "Page Timeout"
-                print(f"✗ PAGE TIMEOUT - Order page took too long to load ({elapsed:.1f}s)\n")
-        else:
-            reason = "Page Load Error"
-            print(f"✗ PAGE LOAD ERROR - {e} ({elapsed:.1f}s)\n")
-
-        return False, elapsed, reason, False
 
-    # Check if order is international by reading shipping country
-    is_international = await check_if_international(page)
-    if is_international:
-        print("→ International order detected\n")
-    else:
-        print("→ Domestic order detected\n")
-
-    # Isolate widget containing the card (match on name, set, condition)
-    # Retry up to 3 times in case page hasn't fully loaded
-    widget_found = False
-    for attempt in range(3):
-        if await isolate_widget(page, card_name, set_name, condition):
-            widget_found = True
-            break
-        else:
+    def __init__(self, page, costs, profiler=None, dry_run=False, capture=None):
+        """
+        Args:
+            page: Playwright page object
+            costs: ResponseCostIndex attached to the page's context (Cost column per product row)
+            profiler: optional NetworkProfiler to attribute requests to refund stages
+            dry_run: If True, don't click Give Refund / Save (PRODUCTION MODE when False)
+            capture: optional FailureCapture that saves a trace/DOM snapshot for failed rows
+        """
+        self.page = page
+        self.costs = costs
+        self.profiler = profiler
+        self.dry_run = dry_run
+        self.capture = capture
+
+    def set_stage(self, stage):
+        if self.profiler:
+            self.profiler.set_stage(stage)
+
+    async def start_row(self):
+        if self.capture:
+            await self.capture.begin_row()
+
+    async def finish_row(self, refund, result, touched_page=True):
+        if self.capture:
+            await self.capture.end_row(refund, result, touched_page)
+
+    async def open_order(self, order_url):
+        try:
+            await self.page.goto(order_url, timeout=30000)
+            await self.page.wait_for_load_state("networkidle", timeout=30000)
+            await asyncio.sleep(1)  # Let dynamic content load
+            print("✓ Order page loaded\n")
+            return None
+        except Exception as e:
+            error_msg = str(e).lower()
+
+            # Categorize the error
+            if 'timeout' in error_msg:
+                if 'net::err' in error_msg or 'navigation' in error_msg:
+                    return "Already Refunded"
+                return "Page Timeout"
+            print(f"  ✗ {e}")
+            return "Page Load Error"
+
+    async def is_international(self):
+        return await check_if_international(self.page)
+
+    async def locate_partial_refund(self, card_name, set_name, condition):
+        # Retry up to 3 times in case page hasn't fully loaded
+        for attempt in range(3):
+            widget_found, partial_refund_href = await locate_partial_refund(self.page, card_name, set_name, condition)
+            if widget_found:
+                return widget_found, partial_refund_href
             if attempt < 2:  # Don't wait after last attempt
                 print(f"  ⚠ Widget not found, waiting 2s and retrying (attempt {attempt + 1}/3)...")
                 await asyncio.sleep(2)
+        return False, None
 
-    if not widget_found:
-        elapsed = time.time() - start_time
-        print(f"✗ CARD NOT FOUND - Widget isolation failed after 3 attempts ({elapsed:.1f}s)\n")
-        return False, elapsed, "Card Not Found", is_international, None, None
-
-    # Click Partial Refund button
-    if not await click_partial_refund(page):
-        elapsed = time.time() - start_time
-        print(f"✗ ALREADY REFUNDED - Partial Refund button missing (card already processed) ({elapsed:.1f}s)\n")
-        return False, elapsed, "Already Refunded", is_international, None, None
-
-    # Wait for refund form to load - give extra time for page transition
-    await page.wait_for_load_state("networkidle", timeout=30000)
-    await asyncio.sleep(2)  # Extra wait for dynamic content
-
-    # Wait for form elements to be present and visible
-    # Only require the critical fields - inventory changes is optional
-    try:
-        await page.wait_for_selector('select#refundOrigin', state='visible', timeout=10000)
-        await page.wait_for_selector('select#refundReason', state='visible', timeout=10000)
-        print("✓ Refund form loaded\n")
-    except Exception as e:
-        elapsed = time.time() - start_time
-        print(f"✗ FORM LOAD ERROR - Refund form did not load properly ({elapsed:.1f}s)\n")
-        return False, elapsed, "Form Load Error", is_international, None, None
-
-    # Prepare refund data based on domestic vs international
-    # Dropdown values are numeric IDs or exact text strings
-    if is_international:
-        # International orders: $5.99 credit (added manually, not via form checkbox)
-        # Always use international message (no separate message for duplicate cards)
-        message = "TCGplayer is fully refunding this card due to an unfortunate inventory issue. We have applied an additional $5.99 in store credit to your TCGplayer account so you can purchase it from another Seller on our site. We're sorry for any inconvenience this may cause you."
-        store_credit = False  # Do NOT check box - manual credit needed
-
-        if is_first_card:
-            print("⚠️  INTERNATIONAL ORDER - Manual $5.99 store credit required!")
-            print("   After refund completes, navigate to customer page and add $5.99")
-            print("   Note: 'Product not in Direct Inventory Order #[ORDER_NUMBER]'\n")
-    else:
-        # Domestic orders: $1.00 credit via checkbox for first card only
-        if is_first_card:
-            message = "TCGplayer is fully refunding this card due to an unfortunate inventory issue. We have applied an additional $1.00 in store credit to your TCGplayer account so you can purchase it from another Seller on our site. We're sorry for any inconvenience this may cause you."
-            store_credit = True
-        else:
-            message = "TCGplayer is fully refunding this card due to an unfortunate inventory issue. We're sorry for any inconvenience this may cause you."
-            store_credit = False
-
-    refund_data = {
-        'refund_origin': '0',  # 0 = CSR Initiated, 1 = Seller Initiated, 2 = Buyer Initiated
-        'refund_reason': 'Product - Inventory Issue',  # Exact text from dropdown
-        'inventory_changes': 'True',  # True = Adjust Inventory, False = Do Not Adjust
-        'message': message,
-        'store_credit': store_credit,
-        'quantity': quantity
-    }
-
-    # Fill form using card name to find correct row
-    await fill_refund_form(page, refund_data)
-
-    # Override generic quantity fill with card-specific row finding
-    # Also extract total cost (qty already calculated in Cost column)
-    success, total_cost = await find_card_row_and_fill_quantity(page, card_name, quantity)
-    if not success:
-        elapsed = time.time() - start_time
-        print(f"✗ QUANTITY ERROR - Failed to fill quantity field ({elapsed:.1f}s)\n")
-        return False, elapsed, "Quantity Fill Error", is_international, None, None
-
-    # Calculate financial amounts
-    # Note: card_price from Column 5 is already the total (quantity × unit price)
-    original_amount = None
-    cost_to_fix = None
-
-    if total_cost is not None:
-        # Original Amount = total from "Cost" column (already includes quantity)
-        original_amount = total_cost
-
-        # Cost to Fix = Original Amount + Store Credit
-        if is_international and is_first_card:
-            store_credit_amount = 5.99
-        elif not is_international and is_first_card:
-            store_credit_amount = 1.00
-        else:
-            store_credit_amount = 0.00
+    async def open_refund_form(self, partial_refund_href):
+        # Give extra time for page transition
+        try:
+            await self.page.goto(partial_refund_href, timeout=30000)
+            await self.page.wait_for_load_state("networkidle", timeout=30000)
+            await asyncio.sleep(2)  # Extra wait for dynamic content
+
+            # Wait for form elements to be present and visible
+            # Only require the critical fields - inventory changes is optional
+            await self.page.wait_for_selector('select#refundOrigin', state='visible', timeout=10000)
+            await self.page.wait_for_selector('select#refundReason', state='visible', timeout=10000)
+            print("✓ Refund form loaded\n")
+            return None
+        except Exception as e:
+            print(f"  ✗ {e}")
+            return "Form Load Error"
+
+    async def fill_refund_form(self, refund_data):
+        success, product_key, cost_text, error_reason = await fill_refund_form(self.page, refund_data)
+        if not success:
+            return False, None, error_reason
+
+        # Cost comes from the form document the browser received; the rendered cell is the fallback
+        total_cost = await self.costs.lookup(self.page.url, product_key)
+        if total_cost is None:
+            total_cost = parse_cost(cost_text or '')
+            if total_cost is not None:
+                print(f"  ⚠ No cost captured for {product_key or 'the card row'} in the form response"
+                      " - using the rendered Cost cell")
+            else:
+                print(f"  ⚠ No cost for {product_key or 'the card row'} in the form response or the rendered table")
+        return True, total_cost, None
 
-        cost_to_fix = original_amount + store_credit_amount
+    async def submit_refund(self):
+        return await submit_refund(self.page, dry_run=self.dry_run)
 
-        print(f"  💰 Original Amount: ${original_amount:.2f} (from Cost column)")
-        print(f"  💰 Store Credit: ${store_credit_amount:.2f}")
-        print(f"  💰 Cost to Fix: ${cost_to_fix:.2f}\n")
-    else:
-        print("  ⚠️  Warning: Could not extract cost for calculation\n")
-
-    # Submit refund (PRODUCTION MODE - WILL ACTUALLY SUBMIT!)
-    submit_success = await submit_refund(page, dry_run=False)
-    if not submit_success:
-        elapsed = time.time() - start_time
-        print(f"✗ SUBMIT ERROR - Failed to submit refund ({elapsed:.1f}s)\n")
-        return False, elapsed, "Submit Error", is_international, original_amount, cost_to_fix
-
-    # For international orders, add $5.99 store credit after refund
-    if is_international and is_first_card:
-        # Extract order number from URL or CSV
-        order_number = refund.get('Order Number', '')
-        if not order_number:
-            # Try to extract from URL if not in CSV
-            # URL format: https://store.tcgplayer.com/admin/Direct/Order/251020-402C
-            order_number = order_url.split('/')[-1]
-
-        # Navigate back to order page first (we may have navigated away during refund)
-        await page.goto(order_url)
-        await page.wait_for_load_state("networkidle")
+    async def add_store_credit(self, order_url, order_number):
+        # Navigate back to order page first (we navigated away during refund)
+        await self.page.goto(order_url)
+        await self.page.wait_for_load_state("networkidle")
         await asyncio.sleep(1)
 
-        # Add the $5.99 credit (PRODUCTION MODE - WILL ACTUALLY SAVE!)
-        credit_success = await add_international_store_credit(page, order_number, dry_run=False)
-        if not credit_success:
-            elapsed = time.time() - start_time
-            print(f"✗ STORE CREDIT ERROR - Failed to add international store credit ({elapsed:.1f}s)\n")
-            return False, elapsed, "Store Credit Error", is_international, original_amount, cost_to_fix
+        return await add_international_store_credit(self.page, order_number, dry_run=self.dry_run)
 
-    elapsed = time.time() - start_time
-    print(f"✓ Refund processed successfully ({elapsed:.1f}s)\n")
-    return True, elapsed, None, is_international, original_amount, cost_to_fix
 
-
-async def save_csv_progress(csv_path, refunds, fieldnames):
+async def main(csv_files, profile_network=False, dry_run=False, prescan=False, prescan_only=False,
+               prescan_concurrency=16, capture_failures=None, capture_dir='failure_captures',
+               lease_store=None, node_id=None, plan_path=None):
     """
-    Save updated CSV with current progress
+    Main automation flow
 
     Args:
-        csv_path: Path to CSV file
-        refunds: List of refund dicts with updated status
-        fieldnames: Original CSV column names
+        csv_files: Refund log CSV paths or glob patterns; all rows share one work queue
+        profile_network: If True, record every request and print a latency/bytes report
+        dry_run: If True, fill forms but don't submit refunds or save store credit
+        prescan: If True, triage rows over HTTP first; the browser only handles rows that need it
+        prescan_only: If True, print the pre-scan report and exit (planning dry run, no CSV writes)
+        prescan_concurrency: Maximum pre-scan requests in flight
+        capture_failures: 'trace' or 'dom' to save debugging state for failed rows only
+        capture_dir: Where failure captures are written
+        lease_store: Shared SQLite file; when set, this node claims orders from it instead of
+            running the whole queue, so several machines can work the same CSVs
+        node_id: This node's name in the lease store (default: hostname-pid)
+        plan_path: If set, write the compiled refund plan here as JSON (rewritten after a pre-scan)
     """
-    with open(csv_path, 'w', newline='') as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(refunds)
-    print("✓ CSV progress saved")
-
-
-async def main(csv_file):
-    """Main automation flow"""
 
-    # Read CSV
-    csv_path = Path(csv_file)
-    if not csv_path.exists():
-        print(f"✗ CSV file not found: {csv_file}")
+    # Read CSVs
+    sources = load_csv_sources(expand_csv_paths(csv_files))
+    if not sources:
+        print("✗ No CSV files to process")
         return
 
-    with open(csv_path, 'r') as f:
-        reader = csv.DictReader(f)
-        fieldnames = reader.fieldnames
-        refunds = list(reader)
-
-    print(f"Found {len(refunds)} refunds to process\n")
+    queue = build_work_queue(sources)
+    order_count = sum(1 for item in queue if item['plan'] and item['plan']['credit_owner'])
+    print(f"Found {len(queue)} refunds ({order_count} orders) across {len(sources)} CSV file(s) to process")
+    for source in sources:
+        print(f"  - {source['path']}: {len(source['refunds'])} rows")
+    print()
+    if plan_path:
+        write_plan(queue, plan_path)
+        print()
+
+    store = None
+    if lease_store:
+        try:
+            store = LeaseStore(lease_store, node_id)
+            added_orders, added_rows = store.load(queue, sources)
+        except LeaseStoreError as e:
+            print(f"✗ {e}")
+            return
+        print(f"✓ Lease store {lease_store}: {added_orders} new orders, {added_rows} new rows for existing orders, "
+              f"{store.outstanding()} outstanding (node {store.node_id})\n")
+        if prescan:
+            print("⚠️  Pre-scan is not used with a lease store - each node checks its claimed rows in the browser\n")
+            prescan = False
 
     async with async_playwright() as p:
         # Use Chrome with your default profile for SSO support
@@ -735,112 +631,64 @@ async def main(csv_file):
         )
         page = context.pages[0] if context.pages else await context.new_page()
 
+        # Install in-page helpers once; every later document gets them automatically
+        await install_refund_helpers(context)
+
+        costs = ResponseCostIndex()
+        costs.attach(context)
+
+        profiler = None
+        if profile_network:
+            profiler = NetworkProfiler()
+            profiler.attach(context)
+            print("✓ Network profiler attached\n")
+
+        capture = None
+        if capture_failures:
+            capture = FailureCapture(context, page, capture_dir, mode=capture_failures)
+
+        driver = PlaywrightDriver(page, costs, profiler, dry_run=dry_run, capture=capture)
+
         # Login once
+        driver.set_stage('login')
         await login_to_tcgplayer(page)
 
+        if prescan or prescan_only:
+            driver.set_stage('prescan')
+            await run_prescan(context.request, queue, prescan_concurrency)
+            if plan_path:
+                write_plan(queue, plan_path)
+            if prescan_only:
+                await context.close()
+                return
+
         # Process each refund
-        success_count = 0
-        failed_count = 0
-        domestic_count = 0
-        international_count = 0
-        domestic_times = []
-        international_times = []
-        processed_orders = set()  # Track ALL orders we've seen (not just previous)
-        times = []
-        error_categories = {}  # Track error reasons
-        script_start = time.time()
+        if capture:
+            await capture.start()
+        stats = RunStats()
+        if store:
+            try:
+                processed = await run_leased(driver, store, stats)
+            finally:
+                # Also runs on Ctrl+C (asyncio.run cancels this task), so finished rows reach the CSVs
+                outstanding = store.outstanding()
+                updated = await export_results(store, sources)
+                if outstanding:
+                    print(f"\n⚠️  Stopped with {outstanding} orders still outstanding in the lease store - "
+                          f"wrote the {updated} results finished so far back to the CSVs")
+                else:
+                    print(f"\n✓ All orders in the lease store are done - wrote {updated} results back to the CSVs")
+            stats.print_summary(processed)
+        else:
+            await run_queue(driver, queue, stats)
+            stats.print_summary(len(queue))
 
-        try:
-            for i, refund in enumerate(refunds, 1):
-                print(f"\n{'#'*80}")
-                print(f"Refund {i}/{len(refunds)}")
-                print('#'*80)
-
-                # Check if this is the first card in this order
-                # Orders may not be consecutive in CSV, so track all seen orders
-                current_order = refund.get('Order Link', '')
-                is_first_card = (current_order not in processed_orders)
-                if current_order:
-                    processed_orders.add(current_order)
-
-                success, elapsed, error_reason, is_international, original_amount, cost_to_fix = await process_single_refund(page, refund, is_first_card)
-                if success and elapsed > 0:  # elapsed > 0 means it was actually processed
-                    success_count += 1
-                    times.append(elapsed)
-                    # Track domestic vs international
-                    if is_international:
-                        international_count += 1
-                        international_times.append(elapsed)
-                    else:
-                        domestic_count += 1
-                        domestic_times.append(elapsed)
-
-                    # Update CSV: Mark as solved and add financial data
-                    refund['Solved?'] = 'TRUE'
-                    if original_amount is not None:
-                        refund['Original Amount'] = f'${original_amount:.2f}'
-                    if cost_to_fix is not None:
-                        refund['Cost to Fix'] = f'${cost_to_fix:.2f}'
-                    await save_csv_progress(csv_path, refunds, fieldnames)
-
-                elif not success:
-                    failed_count += 1
-                    # Track error category
-                    if error_reason:
-                        error_categories[error_reason] = error_categories.get(error_reason, 0) + 1
-
-                    # Update CSV: Mark as failed with error reason
-                    refund['Solved?'] = f'FAILED: {error_reason}' if error_reason else 'FAILED'
-                    await save_csv_progress(csv_path, refunds, fieldnames)
-
-                # Small delay between refunds
-                await asyncio.sleep(2)
-        except KeyboardInterrupt:
-            print("\n\n⚠️  Process interrupted by user (Ctrl+C)")
-
-        total_time = time.time() - script_start
-        skipped_count = len(refunds) - success_count - failed_count
-
-        print(f"\n{'='*80}")
-        print(f"SUMMARY:")
-        print(f"  Success: {success_count}/{len(refunds)} refunds processed")
-
-        # Domestic vs International breakdown
-        if domestic_count > 0 or international_count > 0:
-            print(f"\n  Order Type Breakdown:")
-            if domestic_count > 0:
-                print(f"    - Domestic: {domestic_count}")
-            if international_count > 0:
-                print(f"    - International: {international_count}")
-
-        if failed_count > 0:
-            print(f"\n  Failed: {failed_count} refunds")
-            if error_categories:
-                print(f"\n  Failure Breakdown:")
-                for error_type, count in sorted(error_categories.items(), key=lambda x: x[1], reverse=True):
-                    print(f"    - {error_type}: {count}")
-        if skipped_count > 0:
-            print(f"\n  Skipped: {skipped_count} invalid rows")
-
-        print(f"\nTiming Statistics:")
-        print(f"  Total time: {total_time:.1f}s ({total_time/60:.1f}m)")
-
-        if times:
-            avg_time = sum(times) / len(times)
-            print(f"  Overall average: {avg_time:.1f}s per refund")
-            print(f"  Overall rate: {3600/avg_time:.0f} refunds/hour")
-
-        if domestic_times:
-            domestic_avg = sum(domestic_times) / len(domestic_times)
-            print(f"\n  Domestic average: {domestic_avg:.1f}s per refund")
-            print(f"  Domestic rate: {3600/domestic_avg:.0f} refunds/hour")
-
-        if international_times:
-            intl_avg = sum(international_times) / len(international_times)
-            print(f"\n  International average: {intl_avg:.1f}s per refund")
-            print(f"  International rate: {3600/intl_avg:.0f} refunds/hour")
-
-        print('='*80)
+        if capture:
+            await capture.stop()
+            capture.print_report()
+
+        if profiler:
+            profiler.print_report()
 
         # Keep browser open for inspection
         print("\nBrowser left open - press Ctrl+C to close")
@@ -853,11 +701,31 @@ async def main(csv_file):
 
 
 if __name__ == '__main__':
-    import sys
-
-    if len(sys.argv) < 2:
-        print("Usage: python3 tcgplayer_direct_selectors.py <csv_file>")
-        sys.exit(1)
-
-    csv_file = sys.argv[1]
-    asyncio.run(main(csv_file))
+    parser = argparse.ArgumentParser(description='TCGPlayer refund automation')
+    parser.add_argument('csv_files', nargs='+', help='Refund log CSV(s) or glob patterns (quote globs)')
+    parser.add_argument('--profile-network', action='store_true',
+                        help='Record every request per refund stage and print a latency/bytes report')
+    parser.add_argument('--dry-run', action='store_true',
+                        help="Fill forms but don't submit refunds or save store credit")
+    parser.add_argument('--prescan', action='store_true',
+                        help='Triage rows over HTTP before browser work (international, widget, refundable, cost)')
+    parser.add_argument('--prescan-only', action='store_true',
+                        help='Print the pre-scan report and exit without touching the CSVs')
+    parser.add_argument('--prescan-concurrency', type=int, default=16,
+                        help='Maximum pre-scan requests in flight (default: 16)')
+    parser.add_argument('--capture-failures', choices=['trace', 'dom'],
+                        help='Save a Playwright trace (rolling, per refund) or DOM snapshot only for failed rows')
+    parser.add_argument('--capture-dir', default='failure_captures',
+                        help='Where failure captures are written (default: failure_captures)')
+    parser.add_argument('--lease-store',
+                        help='Shared SQLite lease file for running several nodes on the same CSVs')
+    parser.add_argument('--node-id', help='Name of this node in the lease store (default: hostname-pid)')
+    parser.add_argument('--write-plan', metavar='PATH',
+                        help='Write the compiled refund plan (credit owner, message, credit, expected cost) as JSON')
+    args = parser.parse_args()
+
+    asyncio.run(main(args.csv_files, profile_network=args.profile_network, dry_run=args.dry_run,
+                     prescan=args.prescan, prescan_only=args.prescan_only,
+                     prescan_concurrency=args.prescan_concurrency,
+                     capture_failures=args.capture_failures, capture_dir=args.capture_dir,
+                     lease_store=args.lease_store, node_id=args.node_id, plan_path=args.write_plan))
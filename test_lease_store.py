@@ -0,0 +1,215 @@
+"""
+Tests for the shared lease store: row identity across loads, appending rows to
+existing orders, write-back checks, lease loss and crash recovery
+Every test runs against a real SQLite file in tmp_path with FakeDriver
+"""
+
+import asyncio
+import csv
+import time
+from decimal import Decimal
+
+import pytest
+
+from fake_driver import FakeDriver
+from lease_store import (INTERRUPTED, LeaseStore, LeaseStoreError, apply_store_results, export_results,
+                         run_leased)
+from refund_engine import RunStats, build_work_queue, load_csv_sources, quiet
+
+FIELDNAMES = ['Order Link', 'Order Number', 'Card Name', 'Set Name', 'Cond.', 'Quant.',
+              'Solved?', 'Original Amount', 'Cost to Fix']
+
+
+def refund_row(order, card):
+    return {
+        'Order Link': f"https://store.tcgplayer.com/admin/Direct/Order/{order}",
+        'Order Number': order,
+        'Card Name': card,
+        'Set Name': 'Alpha',
+        'Cond.': 'NM',
+        'Quant.': '1',
+        'Solved?': '',
+        'Original Amount': '',
+        'Cost to Fix': '',
+    }
+
+
+def write_csv(path, rows):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        writer.writerows(rows)
+    return path
+
+
+def read_csv(path):
+    with open(path, newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def load(store, *paths):
+    sources = load_csv_sources(list(paths))
+    return sources, store.load(build_work_queue(sources), sources)
+
+
+def run(store, driver=None):
+    driver = driver or FakeDriver(failure_rates={}, international_rate=0)
+    processed = asyncio.run(run_leased(driver, store, RunStats(), delay=0, idle_wait=0, log=quiet))
+    return driver, processed
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = LeaseStore(tmp_path / 'leases.sqlite', node_id='node-a')
+    yield store
+    store.close()
+
+
+def test_reloading_the_same_csvs_adds_nothing(tmp_path, store):
+    day1 = write_csv(tmp_path / 'day1' / 'refunds.csv', [refund_row('AAAA', 'Card A'), refund_row('BBBB', 'Card Z')])
+    _, added = load(store, day1)
+    assert added == (2, 0)
+
+    other = LeaseStore(store.path, node_id='node-b')
+    try:
+        _, added = load(other, day1)
+    finally:
+        other.close()
+    assert added == (0, 0)
+
+
+def test_other_csv_under_the_same_name_is_refused(tmp_path, store):
+    day1 = write_csv(tmp_path / 'day1' / 'refunds.csv', [refund_row('AAAA', 'Card A'), refund_row('BBBB', 'Card Z')])
+    load(store, day1)
+    driver, _ = run(store)
+    assert len(driver.submitted) == 2
+
+    # Only the second day's CSV: same basename, so it maps to the same source name
+    day2 = write_csv(tmp_path / 'day2' / 'refunds.csv', [refund_row('AAAA', 'Card C')])
+    sources = load_csv_sources([day2])
+    with pytest.raises(LeaseStoreError, match='differ'):
+        store.load(build_work_queue(sources), sources)
+
+    # Nothing was loaded and Card A's result is not written onto Card C's row
+    assert store.outstanding() == 0
+    updated, changed = apply_store_results(store, sources)
+    assert (updated, changed) == (0, [])
+    assert read_csv(day2)[0]['Solved?'] == ''
+
+
+def test_rows_already_loaded_under_another_name_are_refused(tmp_path, store):
+    day1 = write_csv(tmp_path / 'day1' / 'refunds.csv', [refund_row('AAAA', 'Card A')])
+    load(store, day1)
+    run(store)
+
+    # Adding a second folder changes day1's source name from "refunds.csv" to "day1/refunds.csv"
+    day2 = write_csv(tmp_path / 'day2' / 'refunds.csv', [refund_row('CCCC', 'Card C')])
+    with pytest.raises(LeaseStoreError, match='another file name'):
+        load(store, day1, day2)
+    assert store.outstanding() == 0
+
+
+def test_new_row_for_a_finished_order_reopens_it_without_second_credit(tmp_path, store):
+    day1 = tmp_path / 'day1' / 'refunds.csv'
+    day2 = tmp_path / 'day2' / 'refunds.csv'
+    write_csv(day1, [refund_row('AAAA', 'Card A'), refund_row('BBBB', 'Card Z')])
+    write_csv(day2, [])
+    load(store, day1, day2)
+    international = FakeDriver(failure_rates={}, international_rate=1)
+    run(store, international)
+    assert sorted(international.store_credits) == ['AAAA', 'BBBB']
+
+    write_csv(day2, [refund_row('AAAA', 'Card C')])
+    sources, added = load(store, day1, day2)
+    assert added == (0, 1)
+    assert store.outstanding() == 1
+
+    batch = store.claim()
+    assert batch['batch_id'] == 'AAAA'
+    card_c = batch['rows'][-1]
+    assert (card_c['row_index'], card_c['source'], card_c['card_name']) == (1, 'day2/refunds.csv', 'Card C')
+    assert card_c['plan']['credit_owner'] is False
+    store.complete(batch['batch_id'])  # Nothing started: the batch goes back to pending
+
+    driver = FakeDriver(failure_rates={}, international_rate=1)
+    _, processed = run(store, driver)
+    assert processed == 1
+    assert [card for _, card, _ in driver.submitted] == ['Card C']
+    assert driver.store_credits == []
+
+    assert asyncio.run(export_results(store, sources)) == 3
+    assert [row['Solved?'] for row in read_csv(day2)] == ['TRUE']
+
+
+def test_results_are_not_written_to_rows_that_changed(tmp_path, store):
+    path = write_csv(tmp_path / 'refunds.csv', [refund_row('AAAA', 'Card A'), refund_row('BBBB', 'Card B')])
+    load(store, path)
+    run(store)
+
+    rows = read_csv(path)
+    rows[0]['Card Name'] = 'Card Edited'
+    write_csv(path, rows)
+
+    sources = load_csv_sources([path])
+    updated, changed = apply_store_results(store, sources)
+    assert updated == 1
+    assert changed == sources
+    assert [refund['Solved?'] for refund in sources[0]['refunds']] == ['', 'TRUE']
+
+
+def test_money_results_round_trip_exactly(tmp_path, store):
+    path = write_csv(tmp_path / 'refunds.csv', [refund_row('AAAA', 'Card A')])
+    load(store, path)
+    run(store)
+
+    (_, result), = store.results().values()
+    assert isinstance(result['original_amount'], Decimal)
+    assert isinstance(result['cost_to_fix'], Decimal)
+
+    sources = load_csv_sources([path])
+    apply_store_results(store, sources)
+    assert sources[0]['refunds'][0]['Original Amount'] == f"${result['original_amount']:.2f}"
+
+
+def test_lost_lease_stops_the_old_owner(tmp_path, store):
+    path = write_csv(tmp_path / 'refunds.csv', [refund_row('AAAA', 'Card A'), refund_row('AAAA', 'Card B')])
+    load(store, path)
+    store.lease_seconds = -1  # Our claim is already expired
+    batch = store.claim()
+    assert batch is not None
+
+    other = LeaseStore(store.path, node_id='node-b')
+    try:
+        taken = other.claim()
+        assert taken['batch_id'] == batch['batch_id']
+        assert taken['attempts'] == 2
+        assert not store.heartbeat(batch['batch_id'])
+        assert not store.start_row(batch['batch_id'], 0)
+        assert other.start_row(taken['batch_id'], 0)
+    finally:
+        other.close()
+
+
+def test_row_started_by_a_dead_node_is_flagged_not_rerun(tmp_path, store):
+    path = write_csv(tmp_path / 'refunds.csv', [refund_row('AAAA', 'Card A'), refund_row('AAAA', 'Card B')])
+    load(store, path)
+
+    # node-a starts Card A, then dies before finishing it
+    store.lease_seconds = 0.05
+    batch = store.claim()
+    assert store.start_row(batch['batch_id'], 0)
+    time.sleep(0.1)
+
+    other = LeaseStore(store.path, node_id='node-b')
+    try:
+        driver, processed = run(other)
+    finally:
+        other.close()
+
+    assert processed == 1
+    assert [card for _, card, _ in driver.submitted] == ['Card B']
+    results = {key: result for key, (_, result) in store.results().items()}
+    assert results[('refunds.csv', 0)]['error_reason'] == INTERRUPTED
+    assert results[('refunds.csv', 1)]['success']
+    assert store.outstanding() == 0
@@ -0,0 +1,146 @@
+"""
+Tests for the stdlib HTML parser and the page lookups the pre-scan relies on
+Pages are raw HTML as the server sends it: no tbody, unclosed cells and rows
+"""
+
+from decimal import Decimal
+
+import pytest
+
+from page_parsing import (find_card_widget, find_form_row, is_international_order, parse_cost, parse_html,
+                          partial_refund_href, refund_form_rows, resolve_xpath, widget_shows_refunded)
+from response_capture import form_costs
+
+
+def order_page(country_cell, rows=8):
+    """Order page with the shipping table where COUNTRY_XPATH expects it, written without tbody"""
+    table_rows = ''.join(f"<tr><td>Label {i}</td><td>Value {i}</td></tr>" for i in range(1, rows))
+    if rows >= 8:
+        table_rows += f"<tr><td>Country</td><td>{country_cell}</td></tr>"
+    return (
+        "<html><body>"
+        "<div>header</div><div>nav</div><div>alerts</div>"
+        "<div><div>"
+        + "<div></div>" * 5 +
+        f"<div><div><div><table>{table_rows}</table></div></div></div>"
+        "</div></div>"
+        "</body></html>"
+    )
+
+
+def test_resolve_xpath_skips_missing_tbody():
+    root = parse_html(order_page(' US '))
+    cell = resolve_xpath(root, '/html/body/div[4]/div/div[6]/div[1]/div[1]/table/tbody/tr[8]/td[2]')
+    assert cell is not None
+    assert cell.text().strip() == 'US'
+
+
+def test_resolve_xpath_uses_tbody_when_present():
+    root = parse_html("<html><body><table><tbody><tr><td>a</td><td>b</td></tr></tbody></table></body></html>")
+    assert resolve_xpath(root, '/html/body/table/tbody/tr[1]/td[2]').text() == 'b'
+    assert resolve_xpath(root, '/html/body/table/tbody/tr[2]/td[1]') is None
+
+
+@pytest.mark.parametrize('country, expected', [
+    ('US', False),
+    ('us', False),
+    ('CA', True),
+    (' GB\n', True),
+    ('Ship To', None),
+    ('', None),
+])
+def test_is_international_order_on_raw_html(country, expected):
+    assert is_international_order(parse_html(order_page(country))) is expected
+
+
+def test_is_international_order_missing_cell():
+    assert is_international_order(parse_html(order_page('US', rows=5))) is None
+
+
+def test_implied_end_tags():
+    root = parse_html("<table><tr><td>a<td>b<tr><td>c</table><p>one<p>two<ul><li>x<li>y</ul>")
+    rows = root.find_all('tr')
+    assert [[cell.text() for cell in row.element_children()] for row in rows] == [['a', 'b'], ['c']]
+    assert [p.text() for p in root.find_all('p')][-1] == 'two'
+    assert root.find_all('p')[0].text() == 'one'
+    assert [li.text() for li in root.find_all('li')] == ['x', 'y']
+
+
+def test_void_and_stray_end_tags():
+    root = parse_html("<div>a<br>b<img src='x'></span>c</div><div>d</div>")
+    divs = root.find_all('div')
+    assert len(divs) == 2
+    assert divs[0].text() == 'abc'
+    assert divs[1].text() == 'd'
+
+
+def test_card_widget_and_partial_refund_link():
+    html = (
+        "<div class='widget'>Black Lotus - Alpha - Near Mint"
+        "<a href='/admin/Direct/Order/251020-402C/partialrefund?id=1'>Partial Refund</a></div>"
+        "<div class='widget'>Black Lotus - Alpha - Lightly Played Refunded</div>"
+    )
+    root = parse_html(html)
+    widget, count = find_card_widget(root, 'black lotus', 'Alpha', 'NM')
+    assert count == 2
+    assert partial_refund_href(widget, 'https://store.tcgplayer.com/admin/Direct/Order/251020-402C') == \
+        'https://store.tcgplayer.com/admin/Direct/Order/251020-402C/partialrefund?id=1'
+    assert not widget_shows_refunded(widget)
+
+    refunded, _ = find_card_widget(root, 'Black Lotus', 'Alpha', 'LP')
+    assert partial_refund_href(refunded, 'https://store.tcgplayer.com/') is None
+    assert widget_shows_refunded(refunded)
+
+
+def test_widget_shows_refunded_needs_the_word():
+    root = parse_html("<div class='widget'>Card - Set - Near Mint <span>Refund pending</span></div>")
+    widget, _ = find_card_widget(root, 'Card', 'Set', 'NM')
+    assert not widget_shows_refunded(widget)
+
+
+def refund_form(body_rows, hidden=''):
+    header = "<thead><tr><th>#</th><th>Card</th><th>Set</th><th>Cond</th><th>Cost</th></tr></thead>"
+    return f"<form>{hidden}<table>{header}{body_rows}</table></form>"
+
+
+def form_row(index, card, cost):
+    return (f"<tr><td>{index}</td><td>{card}</td><td>Set</td><td>NM</td><td>{cost}</td><td></td><td></td>"
+            f"<td><input name='RefundProducts[{index}].Quantity' value='0'></td></tr>")
+
+
+def test_refund_form_rows_skip_thead():
+    root = parse_html(refund_form(form_row(0, 'Card A', '$1.23') + form_row(1, 'Card B', '$1,234.50')))
+    rows = refund_form_rows(root)
+    assert [row['quantity_input'] for row in rows] == ['RefundProducts[0].Quantity', 'RefundProducts[1].Quantity']
+    assert find_form_row(rows, 'card b')['cost_text'] == '$1,234.50'
+    assert find_form_row(rows, 'Card C') is None
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('$1.23', Decimal('1.23')),
+    ('$ 1,234.50', Decimal('1234.50')),
+    ('Cost: 0.10 USD', Decimal('0.10')),
+    ('$4', None),
+    ('', None),
+])
+def test_parse_cost(text, expected):
+    assert parse_cost(text) == expected
+
+
+def test_form_costs_prefer_cost_cell():
+    hidden = ("<input type='hidden' name='RefundProducts[0].TotalPrice' value='0'>"
+              "<input type='hidden' name='RefundProducts[1].TotalPrice' value='5.00'>")
+    root = parse_html(refund_form(form_row(0, 'Card A', '$12.34') + form_row(1, 'Card B', 'n/a'), hidden))
+    assert form_costs(root) == {
+        'RefundProducts[0].Quantity': Decimal('12.34'),
+        'RefundProducts[1].Quantity': Decimal('5.00'),
+    }
+
+
+def test_unclosed_paragraph_does_not_swallow_next_widget():
+    root = parse_html("<div class='widget'><p>Card A - Set - Near Mint</div>"
+                      "<div class='widget'><p>Card B - Set - Near Mint Refunded</div>")
+    widget, count = find_card_widget(root, 'Card A', 'Set', 'NM')
+    assert count == 2
+    assert 'Card B' not in widget.text()
+    assert not widget_shows_refunded(widget)